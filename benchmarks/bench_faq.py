@@ -0,0 +1,149 @@
+"""
+Benchmark: the local FAQ index, its answer quality against FAQ_MIN_SCORE and its lookup latency.
+
+Labelled questions, paraphrased away from the corpus wording, are looked
+up at several thresholds. "answered" counts lookups over the threshold,
+"correct" those that picked the expected entry, "wrong" answers to
+questions that should have gone to Gemini or to another entry.
+The short routine questions the FAQ exists for must all be answered at
+FAQ_MIN_SCORE; the run exits with status 1 if one is not.
+
+Run from the repository root:
+    python benchmarks/bench_faq.py [--faq data/faq.json] [--lookups 20000]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import FAQ_MIN_SCORE  # noqa: E402
+from bot.faq import FaqIndex  # noqa: E402
+
+# Routine questions on the topics of the system prompt: healing, pain, contraindications, prepayment, preparation
+ROUTINE = [
+    ("как заживает", "healing_time"),
+    ("сколько заживает тату", "healing_time"),
+    ("больно?", "pain"),
+    ("какие противопоказания", "contraindications"),
+    ("какая предоплата", "prepayment"),
+    ("как подготовиться к сеансу", "preparation"),
+]
+
+# (question, expected entry id or None when Gemini should answer)
+CASES = [
+    ("Сколько заживает татуировка на предплечье?", "healing_time"),
+    ("а долго заживать будет?", "healing_time"),
+    ("за сколько дней заживает тату на ноге", "healing_time"),
+    ("чем мазать тату", "aftercare"),
+    ("как правильно ухаживать за новой татуировкой", "aftercare"),
+    ("когда снимать пленку с тату", "aftercare"),
+    ("тату сильно чешется, это нормально?", "itching"),
+    ("больно?", "pain"),
+    ("очень больно делать тату на ребрах?", "pain"),
+    ("больно ли на рёбрах", "pain"),
+    ("какие противопоказания есть у татуировки", "contraindications"),
+    ("можно ли делать тату если я болею", "contraindications"),
+    ("можно ли выпить вина перед сеансом", "alcohol"),
+    ("алкоголь после татуировки можно?", "alcohol"),
+    ("как подготовиться к тату", "preparation"),
+    ("что взять с собой на сеанс", "preparation"),
+    ("Какую предоплату берёт мастер?", "prepayment"),
+    ("нужно ли вносить предоплату", "prepayment"),
+    ("можно перенести запись на другой день?", "reschedule"),
+    ("Какую предоплату берёт мастер и что будет, если я перенесу сеанс?", "reschedule"),
+    ("как записаться", "booking"),
+    ("как записаться к мастеру на тату", "booking"),
+    ("сколько стоит", "price"),
+    ("сколько стоит маленькая татуировка", "price"),
+    ("Можно ли делать тату летом, если я часто купаюсь в море?", "sun_sea"),
+    ("Можно ли после татуировки в сауну", "sun_sea"),
+    ("можно ли загорать с новой тату", "sun_sea"),
+    ("когда можно в спортзал после тату", "sport"),
+    ("с какого возраста делают тату", "age"),
+    ("мне 16, сделаете татуировку?", "age"),
+    ("нужна ли коррекция после заживления", "correction"),
+    ("можно перекрыть старую тату?", "cover_up"),
+    ("в каком стиле вы работаете", "style"),
+    ("привет", None),
+    # A single common word names no particular question
+    ("тату", None),
+    ("татуировка", None),
+    ("мастер", None),
+    ("сеанс", None),
+    ("запись", None),
+    ("кто ты", None),
+    ("что такое гравюра", None),
+    ("Расскажи про Дюрера и его Меланхолию", None),
+    ("расскажи про алхимию", None),
+    ("Придумай эскиз: рыцарь верхом на улитке, в духе старой гравюры", None),
+    ("Череп, ключ и свеча — как собрать это в один читаемый образ на лопатке?", None),
+    ("хочу тату с черепом и вороном, придумай композицию на предплечье", None),
+    ("что означает карта Таро Башня", None),
+    ("месячные во время сеанса можно?", None),
+    ("татуировка покраснела и опухла", None),
+    ("у меня аллергия на краску бывает?", None),
+]
+
+
+def evaluate(index: FaqIndex, threshold: float):
+    answered = correct = wrong = 0
+    for question, expected in CASES:
+        result = index.search(question)
+        if result is None or result[1] < threshold:
+            continue
+        answered += 1
+        if result[0] == expected:
+            correct += 1
+        else:
+            wrong += 1
+    return answered, correct, wrong
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--faq", default="data/faq.json", help="FAQ corpus")
+    parser.add_argument("--lookups", type=int, default=20000, help="lookups timed for the latency figures")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = FaqIndex.load(args.faq, min_score=0.0)
+    build = time.perf_counter() - started
+    stats = index.stats()
+    print(f"{stats['entries']} entries, {stats['terms']} terms, built in {build * 1000:.1f}ms")
+
+    expected_answers = sum(1 for _, expected in CASES if expected is not None)
+    print(f"{len(CASES)} questions, {expected_answers} of them covered by the FAQ")
+    print("threshold  answered  correct  wrong  recall")
+    for threshold in (0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8):
+        answered, correct, wrong = evaluate(index, threshold)
+        print(f"{threshold:9.1f}  {answered:8d}  {correct:7d}  {wrong:5d}  {correct / expected_answers:6.0%}")
+
+    timings = []
+    questions = [question for question, _ in CASES]
+    for n in range(args.lookups):
+        question = questions[n % len(questions)]
+        started = time.perf_counter()
+        index.search(question)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"lookup: median {statistics.median(timings) * 1e6:.1f}us  "
+          f"p99 {timings[int(0.99 * len(timings))] * 1e6:.1f}us  max {timings[-1] * 1e6:.1f}us")
+
+    missed = []
+    for question, expected in ROUTINE:
+        result = index.search(question)
+        if result is None or result[1] < FAQ_MIN_SCORE or result[0] != expected:
+            missed.append(f"{question!r} -> {result}, expected {expected}")
+    print(f"routine questions answered at {FAQ_MIN_SCORE}: {len(ROUTINE) - len(missed)}/{len(ROUTINE)}")
+    for line in missed:
+        print(f"  missed: {line}")
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: compiled IntentMatcher vs. the sequential substring scans it replaced.
+
+Run from the repository root:
+    python benchmarks/bench_intents.py [--repeat 20000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.handlers import KEYWORD_INTENTS  # noqa: E402
+from bot.intents import IntentMatcher  # noqa: E402
+
+SAMPLES = [
+    "hello there",
+    "good evening, how are you doing today?",
+    "this is what my friend said about the tattoo",
+    "thanks a lot for the sketch",
+    "can you help me choose a placement",
+    "are you a bot",
+    "i want a knight riding a snail on my forearm, in the style of old engravings",
+    "ok",
+    "the healing went fine, the lines look clean and the colour settled nicely " * 4,
+]
+
+
+def legacy_match(tables, message_text: str):
+    """The previous implementation: one any() substring scan per table."""
+    for intent, words in tables.items():
+        if any(word in message_text for word in words):
+            return intent
+    return None
+
+
+def padded_tables(extra: int):
+    """The bot's tables with `extra` synthetic keywords added to each intent."""
+    return {
+        intent: list(words) + [f"{intent}{n}word" for n in range(extra)]
+        for intent, words in KEYWORD_INTENTS.items()
+    }
+
+
+def run(tables, repeat: int) -> None:
+    matcher = IntentMatcher(tables)
+    keywords = sum(len(words) for words in tables.values())
+    legacy = timeit.timeit(lambda: [legacy_match(tables, t) for t in SAMPLES], number=repeat)
+    compiled = timeit.timeit(lambda: [matcher.match(t) for t in SAMPLES], number=repeat)
+    calls = repeat * len(SAMPLES)
+    print(f"{keywords:>8} keywords: legacy {legacy / calls * 1e6:7.2f} us/message, "
+          f"compiled {compiled / calls * 1e6:7.2f} us/message, speedup {legacy / compiled:.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=20000, help="passes over the sample set")
+    args = parser.parse_args()
+
+    matcher = IntentMatcher(KEYWORD_INTENTS)
+    print(f"{'message':<50} {'legacy':>10} {'compiled':>10}")
+    for text in SAMPLES:
+        print(f"{text[:50]:<50} {str(legacy_match(KEYWORD_INTENTS, text)):>10} {str(matcher.match(text)):>10}")
+    print()
+
+    for extra in (0, 20, 100):
+        run(padded_tables(extra), max(1, args.repeat // (1 + extra // 10)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark: cold start of main.py, from a fresh interpreter to the first answered update.
+
+Reports, as the median of several runs:
+  import         time to `import main` in a new interpreter
+  webhook ack    process spawn to the first 200 on POST /webhook
+  first reply    process spawn to the first message the bot sends
+
+The bot runs with the stub Bot API from loadtest.py; the stub Gemini is
+installed only when main.py loads the SDK, so its import cost is measured.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [--runs 5] [--bot-latency 0.1]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from loadtest import build_update, free_port  # noqa: E402
+
+_CHUNKS_RE = re.compile(r"^bot_message_chunks_sent_total (\S+)$", re.MULTILINE)
+
+
+def bot_environment(args: argparse.Namespace, port: int) -> dict:
+    state_dir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = dict(os.environ)
+    env.update(
+        TELEGRAM_BOT_TOKEN="123456:STARTUP",
+        GEMINI_API_KEY="startup",
+        WEBHOOK_URL=f"http://127.0.0.1:{port}",
+        PORT=str(port),
+        LOG_LEVEL="WARNING",
+        LOG_FILE=os.path.join(state_dir, "bot.log"),
+        ANSWER_CACHE_MAX_ENTRIES="0",
+        DEBOUNCE_QUIET_PERIOD="0",
+        GEMINI_STREAMING="false",
+        BENCH_BOT_LATENCY=str(args.bot_latency),
+        BENCH_GEMINI_LATENCY=str(args.gemini_latency),
+    )
+    env.pop("BOT_WORKER_INDEX", None)
+    return env
+
+
+def run_stub_bot() -> None:
+    """
+    Entry point of the measured process: main.py with the stubs installed.
+    """
+    from bot import transport
+    from loadtest import ReplyTracker, StubModel, make_stub_request
+
+    StubModel.latency = float(os.environ["BENCH_GEMINI_LATENCY"])
+    transport.HTTPXRequest = make_stub_request(
+        ReplyTracker(), float(os.environ["BENCH_BOT_LATENCY"]), 0.0)
+
+    import main as bot_main
+
+    create_gemini = bot_main.create_gemini
+
+    def create_stub_gemini():
+        import google.generativeai as genai
+
+        genai.GenerativeModel = StubModel
+        return create_gemini()
+
+    bot_main.create_gemini = create_stub_gemini
+    asyncio.run(bot_main.main())
+
+
+def measure_import(args: argparse.Namespace) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    env = bot_environment(args, free_port())
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+async def measure_first_reply(args: argparse.Namespace):
+    import aiohttp
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    body = json.dumps(build_update(1, 10_001, "Расскажи о гравюрах Дюрера")).encode()
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, __file__, "--bot",
+                                                   cwd=ROOT_DIR, env=bot_environment(args, port))
+    try:
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.post(f"{base}/webhook", data=body,
+                                            headers={"Content-Type": "application/json"}) as response:
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if process.returncode is not None:
+                    raise RuntimeError(f"bot exited with code {process.returncode}")
+                await asyncio.sleep(0.025)
+            acked = time.perf_counter() - started
+
+            while True:
+                async with session.get(f"{base}/metrics") as response:
+                    match = _CHUNKS_RE.search(await response.text())
+                if match and float(match.group(1)) >= 1:
+                    break
+                if time.perf_counter() - started > args.timeout:
+                    raise TimeoutError(f"no reply within {args.timeout}s")
+                await asyncio.sleep(0.025)
+            replied = time.perf_counter() - started
+    finally:
+        process.terminate()
+        await process.wait()
+    return acked, replied
+
+
+def summary(values) -> str:
+    return f"median {statistics.median(values) * 1000:7.1f}ms  min {min(values) * 1000:7.1f}ms"
+
+
+async def run(args: argparse.Namespace) -> None:
+    imports, acks, replies = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import(args))
+        acked, replied = await measure_first_reply(args)
+        acks.append(acked)
+        replies.append(replied)
+    print(f"{args.runs} runs, stub Bot API latency {args.bot_latency * 1000:.0f}ms, "
+          f"stub Gemini latency {args.gemini_latency * 1000:.0f}ms")
+    print(f"import       {summary(imports)}")
+    print(f"webhook ack  {summary(acks)}")
+    print(f"first reply  {summary(replies)}")
+
+
+def main() -> None:
+    if "--bot" in sys.argv:
+        run_stub_bot()
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to measure")
+    parser.add_argument("--bot-latency", type=float, default=0.1, help="stub Bot API latency, seconds")
+    parser.add_argument("--gemini-latency", type=float, default=0.1, help="mean stub Gemini latency, seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up on a run after this many seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
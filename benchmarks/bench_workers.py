@@ -0,0 +1,147 @@
+"""
+Benchmark: webhook throughput of the multi-process supervisor as the number of workers grows.
+
+Each run starts `python -m bot.supervisor`-style workers with the stub
+Gemini and stub Bot API from loadtest.py, posts a burst of updates from
+many chats to the front process and waits until the workers report them
+all processed on /metrics. More workers only help with as many free CPU
+cores; on a single core the numbers stay flat and show just the cost of
+the forwarding hop.
+
+Run from the repository root:
+    python benchmarks/bench_workers.py [--workers 1 2 4] [--updates 4000] [--chats 500]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from loadtest import SYNTHETIC_TEXTS, build_update, free_port  # noqa: E402
+
+_PROCESSED_RE = re.compile(r'^bot_updates_total\{outcome="(?:processed|failed)"\} (\S+)$', re.MULTILINE)
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    state_dir = tempfile.mkdtemp(prefix="bench-workers-")
+    defaults = {
+        "TELEGRAM_BOT_TOKEN": "123456:LOADTEST",
+        "GEMINI_API_KEY": "loadtest",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": os.path.join(state_dir, "bot.log"),
+        "RATE_LIMIT_MESSAGES": "1000000",
+        "RATE_LIMIT_DB": os.path.join(state_dir, "ratelimit.sqlite3"),
+        "ANSWER_CACHE_MAX_ENTRIES": "0",
+        "DEBOUNCE_QUIET_PERIOD": "0",
+        "GEMINI_STREAMING": "false",
+        "GEMINI_MAX_CONCURRENCY": "1000",
+        "SEND_GLOBAL_RATE": "1000000",
+        "SEND_CHAT_RATE": "1000000",
+        "SEND_GROUP_RATE": "1000000",
+        "SEND_CHAT_BURST": "1000",
+        "WEBHOOK_QUEUE_SIZE": "100000",
+        "BENCH_GEMINI_LATENCY": str(args.gemini_latency),
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    os.environ.pop("WEBHOOK_URL", None)
+
+
+def run_stub_worker() -> None:
+    """
+    Entry point of one worker process: main.py with the stubs installed.
+    """
+    import google.generativeai as genai
+
+    from bot import transport
+    from loadtest import ReplyTracker, StubModel, make_stub_request
+
+    StubModel.latency = float(os.environ["BENCH_GEMINI_LATENCY"])
+    genai.GenerativeModel = StubModel
+    transport.HTTPXRequest = make_stub_request(ReplyTracker(), 0.0, 0.0)
+
+    import main as bot_main
+    asyncio.run(bot_main.main())
+
+
+async def processed(session, supervisor) -> int:
+    total = 0
+    for worker in supervisor.workers:
+        async with session.get(f"{worker.url}/metrics") as response:
+            text = await response.text()
+        total += sum(int(float(value)) for value in _PROCESSED_RE.findall(text))
+    return total
+
+
+async def measure(workers: int, args: argparse.Namespace) -> float:
+    import aiohttp
+
+    from bot.supervisor import Supervisor
+
+    port = free_port()
+    supervisor = Supervisor(workers, port, free_port(), worker_argv=[sys.executable, __file__, "--worker"],
+                            queue_size=args.updates)
+    await supervisor.start()
+    try:
+        await supervisor.wait_ready()
+        bodies = [
+            json.dumps(build_update(n, 10_000 + n % args.chats, SYNTHETIC_TEXTS[n % len(SYNTHETIC_TEXTS)])).encode()
+            for n in range(1, args.updates + 1)
+        ]
+        url = f"http://127.0.0.1:{port}/webhook"
+        headers = {"Content-Type": "application/json"}
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+            started = time.perf_counter()
+
+            async def post(body: bytes) -> None:
+                async with session.post(url, data=body, headers=headers) as response:
+                    await response.read()
+
+            await asyncio.gather(*(post(body) for body in bodies))
+            while await processed(session, supervisor) < args.updates:
+                if time.perf_counter() - started > args.timeout:
+                    raise TimeoutError(f"{workers} workers did not finish within {args.timeout}s")
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - started
+    finally:
+        await supervisor.stop()
+    return args.updates / elapsed
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(f"{args.updates} updates from {args.chats} chats, stub Gemini latency {args.gemini_latency * 1000:.0f}ms, "
+          f"{os.cpu_count()} CPUs")
+    baseline = None
+    for workers in args.workers:
+        throughput = await measure(workers, args)
+        baseline = baseline or throughput
+        print(f"{workers:>3} workers: {throughput:8.1f} updates/s  ({throughput / baseline:.2f}x)")
+
+
+def main() -> None:
+    if "--worker" in sys.argv:
+        run_stub_worker()
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to try")
+    parser.add_argument("--updates", type=int, default=4000, help="updates per run")
+    parser.add_argument("--chats", type=int, default=500, help="distinct chats the updates come from")
+    parser.add_argument("--concurrency", type=int, default=100, help="parallel POSTs to the front process")
+    parser.add_argument("--gemini-latency", type=float, default=0.01, help="mean stub Gemini latency, seconds")
+    parser.add_argument("--timeout", type=float, default=300.0, help="give up on a run after this many seconds")
+    args = parser.parse_args()
+    configure_environment(args)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+Load test: the full update pipeline of main.py against a stub Bot API and a stub Gemini.
+
+Virtual clients each own a chat, POST an update to /webhook and wait for
+the bot's first reply in that chat before sending the next one. With
+--mode polling they queue the update in the stub Bot API instead, and
+the bot fetches it with getUpdates. Nothing
+leaves the machine: genai.GenerativeModel and the Bot API transport are
+replaced by local stubs with configurable latency and error rates.
+
+Run from the repository root:
+    python benchmarks/loadtest.py [--updates 2000] [--concurrency 50] [--mode polling]
+    python benchmarks/loadtest.py --replay updates.jsonl --gemini-latency 1.5 --stream
+    python benchmarks/loadtest.py --trace-rate 0.1 --profile loadtest.folded
+
+Replay files hold one JSON object per line: either a Telegram update or
+any object with a "text" (or "body"/"title") field used as message text.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SYNTHETIC_TEXTS = [
+    "привет",
+    "спасибо, демон",
+    "Сколько заживает татуировка на предплечье?",
+    "Придумай эскиз: рыцарь верхом на улитке, в духе старой гравюры",
+    "Расскажи про Дюрера и его Меланхолию",
+    "Можно ли делать тату летом, если я часто купаюсь в море?",
+    "Какую предоплату берёт мастер и что будет, если я перенесу сеанс?",
+    "Череп, ключ и свеча — как собрать это в один читаемый образ на лопатке? " * 3,
+]
+
+# Beginnings of the bot's apology messages (see gemini_error_text() in main.py)
+ERROR_REPLIES = ("Произошла ошибка", "Извините", "Ошибка авторизации", "AI сервис", "Временная ошибка")
+BUSY_REPLY = "😈 Демон сейчас занят"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# ---------------------------------------------------------------- stub Gemini
+
+class StubResponse:
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.usage_metadata = None
+
+
+class StubStream:
+    def __init__(self, text: str, chunks: int, latency: float) -> None:
+        self.usage_metadata = None
+        self._text = text
+        self._chunks = max(1, chunks)
+        self._latency = latency
+
+    async def __aiter__(self):
+        size = -(-len(self._text) // self._chunks)
+        for start in range(0, len(self._text), size):
+            await asyncio.sleep(self._latency / self._chunks)
+            yield StubResponse(self._text[start:start + size])
+
+
+class StubModel:
+    """
+    Stand-in for genai.GenerativeModel with a configurable latency and error rate.
+    """
+
+    latency = 0.5
+    jitter = 0.2
+    error_rate = 0.0
+    answer_chars = 600
+    stream_chunks = 10
+
+    def __init__(self, model_name: str = "stub", **kwargs: Any) -> None:
+        self.model_name = model_name
+
+    def _latency(self) -> float:
+        return max(0.0, random.gauss(self.latency, self.latency * self.jitter))
+
+    def _answer(self, contents: Any) -> str:
+        question = str(contents)[:200]
+        filler = "Демон перелистывает пыльный фолиант и отвечает неспешно. "
+        body = (filler * (self.answer_chars // len(filler) + 1))[:self.answer_chars]
+        return f"{question}\n\n{body}"
+
+    def _maybe_fail(self) -> None:
+        if random.random() < self.error_rate:
+            from google.api_core import exceptions as google_exceptions
+            raise google_exceptions.ServiceUnavailable("stub Gemini failure")
+
+    async def generate_content_async(self, contents: Any, stream: bool = False, **kwargs: Any):
+        if stream:
+            await asyncio.sleep(self._latency() / self.stream_chunks)
+            self._maybe_fail()
+            return StubStream(self._answer(contents), self.stream_chunks, self._latency())
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        return StubResponse(self._answer(contents))
+
+
+# ------------------------------------------------------------- stub Bot API
+
+class ReplyTracker:
+    """
+    Resolves a client's pending update when the bot sends the first message of its reply.
+    Also holds the updates that getUpdates hands out in polling mode.
+    """
+
+    def __init__(self) -> None:
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.calls: Counter = Counter()
+        self.updates: Deque[Dict[str, Any]] = deque()
+        self._arrived: Optional[asyncio.Event] = None
+
+    def push(self, update: Dict[str, Any]) -> None:
+        """Queue an update for getUpdates; ids must be pushed in ascending order."""
+        self.updates.append(update)
+        if self._arrived is not None:
+            self._arrived.set()
+
+    async def get_updates(self, offset: Optional[int], limit: int, timeout: float) -> List[Dict[str, Any]]:
+        # Like Telegram: the offset confirms everything below it, an empty queue is waited on
+        while self.updates and offset is not None and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self._arrived = self._arrived or asyncio.Event()
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.updates, limit))
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending[chat_id] = future
+        return future
+
+    def on_request(self, endpoint: str, params: Dict[str, Any]) -> None:
+        self.calls[endpoint] += 1
+        if endpoint != "sendMessage":
+            return
+        text = str(params.get("text", ""))
+        if text.startswith("(продолжение"):
+            return
+        future = self.pending.pop(int(params.get("chat_id", 0)), None)
+        if future is not None and not future.done():
+            future.set_result(text)
+
+
+def make_stub_request(tracker: ReplyTracker, latency: float, error_rate: float):
+    from telegram.request import BaseRequest
+
+    message_ids = itertools.count(1)
+
+    class StubRequest(BaseRequest):
+        """
+        Bot API transport that answers locally instead of calling api.telegram.org.
+        """
+
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            pass
+
+        @property
+        def read_timeout(self) -> Optional[float]:
+            return 5.0
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+        async def do_request(self, url: str, method: str, request_data=None, *args: Any,
+                             **kwargs: Any) -> Tuple[int, bytes]:
+            endpoint = url.rsplit("/", 1)[-1]
+            params = request_data.parameters if request_data is not None else {}
+            if latency:
+                await asyncio.sleep(latency)
+            if error_rate and endpoint != "getMe" and random.random() < error_rate:
+                body = {"ok": False, "error_code": 500, "description": "Internal Server Error: stub"}
+                return 500, json.dumps(body).encode()
+            tracker.on_request(endpoint, params)
+
+            if endpoint == "getMe":
+                result: Any = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+            elif endpoint == "getUpdates":
+                result = await tracker.get_updates(params.get("offset"), params.get("limit", 100),
+                                                   params.get("timeout", 0))
+            elif endpoint in ("sendMessage", "editMessageText"):
+                result = {
+                    "message_id": params.get("message_id") or next(message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": params.get("chat_id"), "type": "private"},
+                    "text": params.get("text", ""),
+                }
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return StubRequest
+
+
+# ------------------------------------------------------------------ updates
+
+def load_texts(path: Optional[str]) -> List[Any]:
+    """
+    Message texts or raw updates to send; synthetic texts when no file is given.
+    """
+    if not path:
+        return list(SYNTHETIC_TEXTS)
+    items: List[Any] = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "message" in record:
+                items.append(record)
+                continue
+            text = next((record[k] for k in ("text", "body", "title") if isinstance(record.get(k), str)), None)
+            if text:
+                items.append(text)
+    if not items:
+        raise SystemExit(f"No usable records in {path}")
+    return items
+
+
+def build_update(update_id: int, chat_id: int, item: Any) -> Dict[str, Any]:
+    if isinstance(item, dict):
+        update = json.loads(json.dumps(item))
+        update["update_id"] = update_id
+        update["message"]["chat"] = {"id": chat_id, "type": "private"}
+        update["message"]["from"] = {"id": chat_id, "is_bot": False, "first_name": "Load"}
+        return update
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": item,
+        },
+    }
+
+
+# -------------------------------------------------------------------- run
+
+def configure_environment(args: argparse.Namespace, port: int) -> None:
+    """
+    Settings for main.py; variables already set in the environment win.
+    """
+    defaults = {
+        "TELEGRAM_BOT_TOKEN": "123456:LOADTEST",
+        "GEMINI_API_KEY": "loadtest",
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+        "LOG_LEVEL": args.log_level,
+        "LOG_FILE": os.path.join(tempfile.gettempdir(), "loadtest-bot.log"),
+        "RATE_LIMIT_MESSAGES": "1000000",
+        "GEMINI_STREAMING": "true" if args.stream else "false",
+        "ANSWER_CACHE_MAX_ENTRIES": "1000" if args.answer_cache else "0",
+        "DEBOUNCE_QUIET_PERIOD": str(args.debounce),
+        "TRACE_SAMPLE_RATE": str(args.trace_rate),
+        "DEBUG_TOKEN": DEBUG_TOKEN if args.profile else "",
+    }
+    if not args.telegram_limits:
+        defaults.update(SEND_GLOBAL_RATE="1000000", SEND_CHAT_RATE="1000000",
+                        SEND_GROUP_RATE="1000000", SEND_CHAT_BURST="1000")
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    os.environ["PORT"] = str(port)
+    os.environ["BOT_MODE"] = args.mode
+
+
+DEBUG_TOKEN = "loadtest"
+
+
+async def take_profile(port: int, seconds: float, path: str) -> None:
+    """
+    Profile the bot through /debug/profile while the clients run and save the collapsed stacks.
+    """
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{port}/debug/profile", params={"seconds": str(seconds)},
+                               headers={"Authorization": f"Bearer {DEBUG_TOKEN}"}) as response:
+            body = await response.text()
+    if response.status != 200:
+        print(f"profile failed: HTTP {response.status} {body}")
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(body)
+    samples = sum(int(line.rsplit(" ", 1)[1]) for line in body.splitlines())
+    print(f"profile: {samples} stack samples in {len(body.splitlines())} distinct stacks written to {path}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    import aiohttp
+
+    port = free_port()
+    configure_environment(args, port)
+
+    StubModel.latency = args.gemini_latency
+    StubModel.error_rate = args.gemini_error_rate
+    StubModel.answer_chars = args.answer_chars
+    tracker = ReplyTracker()
+
+    import google.generativeai as genai
+
+    from bot import transport
+
+    genai.GenerativeModel = StubModel
+    transport.HTTPXRequest = make_stub_request(tracker, args.bot_latency, args.bot_error_rate)
+
+    import main as bot_main
+    from bot import metrics
+
+    runner = await bot_main.start_bot()
+
+    items = load_texts(args.replay)
+    url = f"http://127.0.0.1:{port}/webhook"
+    latencies: List[float] = []
+    outcomes: Counter = Counter()
+    update_ids = itertools.count(1)
+    remaining = itertools.count()
+
+    async def client(session: aiohttp.ClientSession, chat_id: int) -> None:
+        while next(remaining) < args.updates:
+            update_id = next(update_ids)
+            item = items[(update_id - 1) % len(items)]
+            reply = tracker.expect(chat_id)
+            started = time.perf_counter()
+            if args.mode == "polling":
+                tracker.push(build_update(update_id, chat_id, item))
+            else:
+                async with session.post(url, json=build_update(update_id, chat_id, item)) as response:
+                    await response.read()
+                    if response.status != 200:
+                        tracker.pending.pop(chat_id, None)
+                        outcomes[f"http_{response.status}"] += 1
+                        continue
+            try:
+                text = await asyncio.wait_for(reply, args.reply_timeout)
+            except asyncio.TimeoutError:
+                tracker.pending.pop(chat_id, None)
+                outcomes["no_reply"] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if text.startswith(BUSY_REPLY):
+                outcomes["shed"] += 1
+            else:
+                outcomes["error_reply" if text.startswith(ERROR_REPLIES) else "ok"] += 1
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    started = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            # The profile request has a session of its own, so it takes none of the clients' connections
+            profile = (asyncio.ensure_future(take_profile(port, args.profile_seconds, args.profile))
+                       if args.profile else None)
+            await asyncio.gather(*(client(session, 10_000 + n) for n in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            if profile is not None:
+                await profile
+    finally:
+        await bot_main.stop_bot(runner)
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    report(args, elapsed, latencies, outcomes, tracker, traced_peak, metrics, bot_main.tracer)
+
+
+def report(args, elapsed, latencies, outcomes, tracker, traced_peak, metrics, tracer=None) -> None:
+    replied = len(latencies)
+    print(f"updates: {args.updates}  concurrency: {args.concurrency}  "
+          f"gemini: {args.gemini_latency:.2f}s, {args.gemini_error_rate:.0%} errors  "
+          f"bot api: {args.bot_latency * 1000:.0f}ms, {args.bot_error_rate:.0%} errors  "
+          f"mode: {'stream' if args.stream else 'whole'}  ingest: {args.mode}")
+    print(f"elapsed: {elapsed:.2f}s  throughput: {replied / elapsed:.1f} replies/s")
+    print(f"latency to first reply: p50 {percentile(latencies, 0.50) * 1000:.0f}ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:.0f}ms  p99 {percentile(latencies, 0.99) * 1000:.0f}ms  "
+          f"max {max(latencies, default=float('nan')) * 1000:.0f}ms")
+    print("outcomes: " + ", ".join(f"{name}={count}" for name, count in sorted(outcomes.items())))
+    print("bot api calls: " + ", ".join(f"{name}={count}" for name, count in sorted(tracker.calls.items())))
+
+    stages = []
+    for stage in ("parse", "queue", "handler", "faq", "gemini", "send"):
+        series = metrics.STAGE_SECONDS.labels(stage)
+        count = sum(series.counts)
+        if count:
+            stages.append(f"{stage} {series.sum / count * 1000:.1f}ms")
+    print("mean stage time: " + ", ".join(stages))
+
+    pools = []
+    for pool in ("bot_api", "get_updates"):
+        series = metrics.HTTP_POOL_WAIT_SECONDS.labels(pool)
+        count = sum(series.counts)
+        if count:
+            timeouts = metrics.HTTP_POOL_TIMEOUTS.labels(pool).get()
+            pools.append(f"{pool} {series.sum / count * 1000:.1f}ms ({timeouts:.0f} timeouts)")
+    print("mean connection pool wait: " + ", ".join(pools))
+
+    if tracer is not None and tracer.traces:
+        traces = list(tracer.traces)
+        lag = metrics.LOOP_LAG_SECONDS.labels()
+        print(f"traces: {len(traces)} kept  mean blocked {statistics.mean(t.blocked for t in traces) * 1000:.2f}ms "
+              f"in {statistics.mean(t.callbacks for t in traces):.1f} callbacks  "
+              f"max loop lag {max(t.loop_lag for t in traces) * 1000:.1f}ms  "
+              f"mean lag probe {lag.sum / max(1, sum(lag.counts)) * 1000:.2f}ms  "
+              f"slow callbacks {metrics.LOOP_SLOW_CALLBACKS.labels().get():.0f}")
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mib = peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    line = f"peak RSS: {peak_rss_mib:.1f} MiB"
+    if traced_peak is not None:
+        line += f"  peak traced Python memory: {traced_peak / (1024 * 1024):.1f} MiB"
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--updates", type=int, default=2000, help="total updates to send")
+    parser.add_argument("--concurrency", type=int, default=50, help="virtual clients, one chat each")
+    parser.add_argument("--mode", choices=("webhook", "polling"), default="webhook",
+                        help="how the bot receives updates (BOT_MODE)")
+    parser.add_argument("--replay", help="JSONL file with updates or texts to replay")
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="mean stub Gemini latency, seconds")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="share of failing Gemini calls")
+    parser.add_argument("--answer-chars", type=int, default=600, help="length of stub Gemini answers")
+    parser.add_argument("--bot-latency", type=float, default=0.02, help="stub Bot API latency, seconds")
+    parser.add_argument("--bot-error-rate", type=float, default=0.0, help="share of failing Bot API calls")
+    parser.add_argument("--stream", action="store_true", help="use streamed Gemini replies")
+    parser.add_argument("--debounce", type=float, default=0.0,
+                        help="DEBOUNCE_QUIET_PERIOD; adds that much latency to every reply")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache enabled")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep Telegram's outbound flood limits instead of lifting them")
+    parser.add_argument("--reply-timeout", type=float, default=10.0, help="seconds to wait for a reply")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL for the bot during the run")
+    parser.add_argument("--trace-rate", type=float, default=0.0, help="TRACE_SAMPLE_RATE, share of updates traced")
+    parser.add_argument("--profile", help="file for the collapsed stacks of a profile taken during the run")
+    parser.add_argument("--profile-seconds", type=float, default=5.0, help="length of the --profile profile")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python allocations (slower)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
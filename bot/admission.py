@@ -0,0 +1,146 @@
+"""
+Admission control for expensive upstream calls.
+A bounded priority queue in front of a fixed number of slots, which sheds requests that could not be served within the latency SLO.
+"""
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+from . import metrics
+
+# Request priorities: lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class AdmissionRejected(Exception):
+    """
+    The request was shed instead of queued.
+    `reason` is "full" (queue at capacity), "slo" (expected wait above the SLO)
+    or "background" (low-priority work while users are waiting).
+    """
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(f"request shed: {reason}")
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Lets at most `concurrency` requests run; up to `max_queue` more wait in
+    priority order. A request is rejected up front, rather than left to
+    wait, when the queue is full or when the expected wait exceeds `slo`
+    seconds. The expected wait is the queue depth times the recent average
+    service time, divided by `concurrency`. Background requests
+    never wait: they are rejected whenever no slot is free.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int, slo: float = 0.0) -> None:
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.slo = slo
+        self._active = 0
+        self._queued = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._service_time: Optional[float] = None  # moving average, seconds
+
+        self.admitted = 0
+        self.shed = 0
+
+    @property
+    def active(self) -> int:
+        """Requests holding a slot."""
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a slot."""
+        return self._queued
+
+    def expected_wait(self) -> float:
+        """
+        Estimated time a new request would spend in the queue.
+        """
+        if self._active < self.concurrency and not self._queued:
+            return 0.0
+        return (self._queued + 1) * (self._service_time or 0.0) / self.concurrency
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE) -> AsyncIterator[None]:
+        """
+        Hold a slot for the duration of the block.
+        Raises AdmissionRejected if the request is shed.
+        """
+        await self._acquire(priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._service_time = elapsed if self._service_time is None else 0.8 * self._service_time + 0.2 * elapsed
+            self._release()
+
+    def try_acquire(self) -> bool:
+        """
+        Take a slot if one is free right now, never queueing or shedding.
+        A True result must be paired with release().
+        """
+        if self._active < self.concurrency and not self._queued:
+            self._active += 1
+            self.admitted += 1
+            return True
+        return False
+
+    def release(self) -> None:
+        """
+        Give back a slot taken with try_acquire().
+        """
+        self._release()
+
+    async def _acquire(self, priority: int) -> None:
+        if self._active < self.concurrency and not self._queued:
+            self._active += 1
+            self.admitted += 1
+            return
+        if priority >= BACKGROUND:
+            self._reject("background")
+        if self._queued >= self.max_queue:
+            self._reject("full")
+        if self.slo > 0 and self.expected_wait() > self.slo:
+            self._reject("slo")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued += 1
+        queued_at = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: pass the slot on
+                self._release()
+            future.cancel()
+            raise
+        finally:
+            self._queued -= 1
+            metrics.GEMINI_QUEUE_SECONDS.observe(time.perf_counter() - queued_at)
+        self.admitted += 1
+
+    def _release(self) -> None:
+        # Hand the slot straight to the best waiter, skipping abandoned ones
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _reject(self, reason: str) -> None:
+        self.shed += 1
+        metrics.GEMINI_SHED.labels(reason).inc()
+        raise AdmissionRejected(reason)
@@ -0,0 +1,240 @@
+"""
+Answer cache for repeated questions.
+In-memory TTL/LRU tier with an optional SQLite tier and single-flight coalescing of identical requests.
+"""
+
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,!?…;:-—()\"'«»"
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Build a cache key from a user question.
+    Case, 'ё', repeated whitespace and surrounding punctuation are ignored.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _WHITESPACE_RE.sub(" ", text)
+    return text.strip(_EDGE_PUNCTUATION)
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of answers keyed by normalized prompt.
+    Memory use is capped by entry count and by the UTF-8 size of stored answers.
+    With `db_path` set, answers are also kept in SQLite and survive restarts.
+    The SQLite tier is read and written on a thread of its own and waits at
+    most `busy_timeout` seconds for a lock held by another process; past
+    that the lookup counts as a miss and the write is dropped.
+    A `max_entries` of 0 disables caching but keeps single-flight coalescing.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, db_path: Optional[str] = None,
+                 busy_timeout: float = 0.1) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (answer, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if db_path and max_entries > 0:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers "
+                "(key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+            # Setup may wait for the lock; lookups and writes later may not
+            self._db.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+            # The connection is used from this one thread only
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-cache-db")
+
+    async def get(self, prompt: str) -> Optional[str]:
+        """
+        Return the cached answer for `prompt`, or None.
+        """
+        key = normalize_prompt(prompt)
+        answer = self._lookup(key)
+        if answer is None:
+            answer = await self._load(key)
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def set(self, prompt: str, answer: str) -> None:
+        """
+        Store an answer for `prompt` in every configured tier.
+        """
+        if self.max_entries <= 0:
+            return
+        key = normalize_prompt(prompt)
+        expires_at = time.time() + self.ttl
+        self._remember(key, answer, expires_at)
+        if self._executor is not None:
+            # Nobody waits for the write
+            self._executor.submit(self._store, key, answer, expires_at).add_done_callback(self._log_failure)
+
+    async def get_or_compute(self, prompt: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Return the cached answer or compute it once.
+        Concurrent calls for the same prompt wait for the first caller's result.
+        Failures are propagated to all waiters and are not cached.
+        """
+        key = normalize_prompt(prompt)
+        while True:
+            answer = self._lookup(key)
+            if answer is None:
+                answer = await self._load(key)
+            if answer is not None:
+                self.hits += 1
+                return answer
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The leader was abandoned: take over unless we were cancelled ourselves
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            answer = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody was waiting
+            future.exception()
+            raise
+        else:
+            self.set(prompt, answer)
+            future.set_result(answer)
+            return answer
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters for tuning the cache size and TTL.
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self) -> None:
+        """
+        Close the SQLite tier.
+        """
+        if self._executor is not None:
+            # Pending writes go out first
+            self._executor.shutdown()
+            self._executor = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _lookup(self, key: str) -> Optional[str]:
+        """
+        The answer held in memory, or None.
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            answer, expires_at, _ = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                return answer
+            self._forget(key)
+            self.expirations += 1
+        return None
+
+    async def _load(self, key: str) -> Optional[str]:
+        """
+        The answer held in the SQLite tier, or None; it is kept in memory from then on.
+        """
+        if self._executor is None:
+            return None
+        try:
+            row = await asyncio.get_running_loop().run_in_executor(self._executor, self._fetch, key)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Answer cache database unavailable ({e}), treating as a miss")
+            return None
+        if row is None:
+            return None
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def _fetch(self, key: str) -> Optional[Tuple[str, float]]:
+        return self._db.execute(
+            "SELECT answer, expires_at FROM answers WHERE key = ? AND expires_at > ?",
+            (key, time.time())).fetchone()
+
+    def _store(self, key: str, answer: str, expires_at: float) -> None:
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, expires_at) VALUES (?, ?, ?)",
+                (key, answer, expires_at))
+            self._db.commit()
+        except sqlite3.OperationalError:
+            self._db.rollback()
+            raise
+
+    @staticmethod
+    def _log_failure(future) -> None:
+        if future.exception() is not None:
+            logger.warning(f"Answer cache write skipped: {future.exception()}")
+
+    def _remember(self, key: str, answer: str, expires_at: float) -> None:
+        size = len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._forget(key)
+        self._entries[key] = (answer, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._forget(oldest)
+            self.evictions += 1
+
+    def _forget(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
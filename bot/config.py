@@ -6,18 +6,139 @@ Handles environment variables and bot settings.
 import os
 from typing import Optional
 
+from dotenv import load_dotenv
+
+# Load .env before any setting is read
+load_dotenv()
+
 # Bot configuration
 BOT_TOKEN: Optional[str] = os.getenv("TELEGRAM_BOT_TOKEN")
 
 # Logging configuration
 LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE: str = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES: int = int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024)))  # rotate the file at this size
+LOG_BACKUP_COUNT: int = int(os.getenv("LOG_BACKUP_COUNT", "3"))
+LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records beyond this are dropped
+LOG_MAX_FIELD_LENGTH: int = int(os.getenv("LOG_MAX_FIELD_LENGTH", "300"))  # chars per logged text, 0 = no limit
+
+# Profiling and tracing, both off by default. /debug/profile and /debug/traces exist only when DEBUG_TOKEN is set
+# and answer requests with "Authorization: Bearer <DEBUG_TOKEN>"
+DEBUG_TOKEN: str = os.getenv("DEBUG_TOKEN", "")
+PROFILE_MAX_SECONDS: float = float(os.getenv("PROFILE_MAX_SECONDS", "60"))  # longest profile one request may take
+PROFILE_INTERVAL: float = float(os.getenv("PROFILE_INTERVAL", "0.01"))  # seconds between stack samples
+# Share of updates traced stage by stage (0 disables tracing and its event loop instrumentation)
+TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_BUFFER: int = int(os.getenv("TRACE_BUFFER", "200"))  # recent traces kept for /debug/traces
+TRACE_LOOP_LAG_INTERVAL: float = float(os.getenv("TRACE_LOOP_LAG_INTERVAL", "0.05"))  # seconds between lag probes
+TRACE_SLOW_CALLBACK: float = float(os.getenv("TRACE_SLOW_CALLBACK", "0.1"))  # log callbacks blocking the loop this long
 
 # Rate limiting configuration
 RATE_LIMIT_MESSAGES: int = int(os.getenv("RATE_LIMIT_MESSAGES", "10"))
 RATE_LIMIT_WINDOW: int = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # seconds
+RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # memory or sqlite
+RATE_LIMIT_DB: str = os.getenv("RATE_LIMIT_DB", "ratelimit.sqlite3")  # shared file for the sqlite backend
+# Longest wait for a SQLite file locked by another process (rate limits, answer cache); past it the check
+# is skipped: the message is not rate limited, the cache is not used
+SQLITE_BUSY_TIMEOUT: float = float(os.getenv("SQLITE_BUSY_TIMEOUT", "0.1"))  # seconds
+RATE_LIMIT_SWEEP_INTERVAL: int = int(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "300"))  # seconds
+
+# How updates arrive: "webhook" (Telegram calls WEBHOOK_URL) or "polling" (the bot calls getUpdates)
+BOT_MODE: str = os.getenv("BOT_MODE", "webhook").lower()
+
+# Webhook configuration
+PORT: int = int(os.getenv("PORT", "5000"))
+WEBHOOK_URL: Optional[str] = os.getenv("WEBHOOK_URL")
+# A worker stays with a message through the debounce quiet period too, so there are more workers than Gemini slots
+WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "32"))
+WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "256"))
+# Re-delivered updates are dropped by update_id; the high-water mark can survive restarts
+UPDATE_DEDUP_WINDOW: int = int(os.getenv("UPDATE_DEDUP_WINDOW", "4096"))  # update ids remembered; 0 disables
+UPDATE_DEDUP_STATE: Optional[str] = os.getenv("UPDATE_DEDUP_STATE") or None  # file for the high-water mark
+
+# Polling configuration (BOT_MODE=polling); updates of one chat are processed in order
+POLLING_WORKERS: int = int(os.getenv("POLLING_WORKERS", "32"))  # updates processed at once
+POLLING_LIMIT: int = int(os.getenv("POLLING_LIMIT", "100"))  # updates per getUpdates call, at most 100
+POLLING_TIMEOUT: int = int(os.getenv("POLLING_TIMEOUT", "50"))  # seconds getUpdates waits for new updates
+POLLING_MAX_PENDING: int = int(os.getenv("POLLING_MAX_PENDING", "400"))  # fetching pauses above this
+
+# Multi-process mode (python -m bot.supervisor): updates are sharded across worker processes by chat id
+WORKER_PROCESSES: int = int(os.getenv("WORKER_PROCESSES", "2"))
+WORKER_BASE_PORT: int = int(os.getenv("WORKER_BASE_PORT", str(PORT + 1)))  # workers listen on 127.0.0.1
+WORKER_FORWARD_QUEUE_SIZE: int = int(os.getenv("WORKER_FORWARD_QUEUE_SIZE", "1024"))  # per worker
+# Set by the supervisor for its workers; unset when the bot runs as a single process
+WORKER_INDEX: Optional[int] = int(os.environ["BOT_WORKER_INDEX"]) if os.getenv("BOT_WORKER_INDEX") else None
+
+# Gemini configuration
+GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_MAX_CONCURRENCY: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_TIMEOUT: float = float(os.getenv("GEMINI_TIMEOUT", "60"))  # seconds
+# Keep-alive pings on the gRPC connection to Gemini, also while idle (0 keeps the SDK's own channel)
+GEMINI_KEEPALIVE: float = float(os.getenv("GEMINI_KEEPALIVE", "300"))  # seconds; servers refuse much more frequent pings
+
+# Admission control: requests waiting for a Gemini slot; shed when the queue is full or the wait would pass the SLO
+GEMINI_QUEUE_SIZE: int = int(os.getenv("GEMINI_QUEUE_SIZE", "32"))
+GEMINI_QUEUE_SLO: float = float(os.getenv("GEMINI_QUEUE_SLO", "20"))  # seconds of expected wait; 0 disables
+
+# Resilience: retries with jittered backoff, a circuit breaker per model, a fallback model and hedged requests
+GEMINI_FALLBACK_MODEL: str = os.getenv("GEMINI_FALLBACK_MODEL", "")  # e.g. gemini-2.5-flash-lite; empty disables
+GEMINI_RETRIES: int = int(os.getenv("GEMINI_RETRIES", "2"))
+GEMINI_RETRY_BASE_DELAY: float = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))  # seconds
+GEMINI_RETRY_MAX_DELAY: float = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "4"))  # seconds
+GEMINI_BREAKER_THRESHOLD: int = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))  # consecutive failures; 0 disables
+GEMINI_BREAKER_RESET: float = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # seconds before a probe
+GEMINI_HEDGE_AFTER: float = float(os.getenv("GEMINI_HEDGE_AFTER", "0"))  # seconds; 0 disables hedging
+
+# Context caching of the system prompt (Gemini bills cached tokens at a discount, plus storage per hour)
+GEMINI_CONTEXT_CACHE: bool = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+GEMINI_CONTEXT_CACHE_TTL: float = float(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))  # seconds
+GEMINI_CONTEXT_CACHE_REFRESH: float = float(os.getenv("GEMINI_CONTEXT_CACHE_REFRESH", "300"))  # seconds before expiry
+
+# Streaming replies: the message is edited as Gemini produces text
+GEMINI_STREAMING: bool = os.getenv("GEMINI_STREAMING", "true").lower() == "true"
+STREAM_EDIT_INTERVAL: float = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # seconds between edits
+
+# Outbound flood limits (Telegram: ~30 msg/s overall, ~1 msg/s per chat, 20 msg/min per group)
+SEND_GLOBAL_RATE: float = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # messages per second
+SEND_CHAT_RATE: float = float(os.getenv("SEND_CHAT_RATE", "1"))  # messages per second per private chat
+SEND_CHAT_BURST: int = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE: float = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))  # messages per second per group
+SEND_MAX_RETRIES: int = int(os.getenv("SEND_MAX_RETRIES", "3"))  # retries after RetryAfter
+
+# Bot API connection pools; getUpdates has a pool of its own, so a long poll never holds up a send
+TELEGRAM_POOL_SIZE: int = int(os.getenv("TELEGRAM_POOL_SIZE", "64"))  # requests in flight at once
+TELEGRAM_GET_UPDATES_POOL_SIZE: int = int(os.getenv("TELEGRAM_GET_UPDATES_POOL_SIZE", "1"))
+TELEGRAM_POOL_TIMEOUT: float = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "5"))  # seconds to wait for a connection
+TELEGRAM_CONNECT_TIMEOUT: float = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))  # seconds
+TELEGRAM_READ_TIMEOUT: float = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))  # seconds, on top of a long poll
+TELEGRAM_WRITE_TIMEOUT: float = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", "10"))  # seconds
+TELEGRAM_KEEPALIVE: float = float(os.getenv("TELEGRAM_KEEPALIVE", "30"))  # seconds an idle connection stays open
+TELEGRAM_HTTP2: bool = os.getenv("TELEGRAM_HTTP2", "false").lower() == "true"  # needs the h2 package
+
+# Answer cache configuration (ANSWER_CACHE_MAX_ENTRIES=0 disables caching)
+ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_MAX_BYTES: int = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+ANSWER_CACHE_TTL: float = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds
+ANSWER_CACHE_DB: Optional[str] = os.getenv("ANSWER_CACHE_DB") or None  # SQLite file for the persistent tier
+
+# Conversation memory: recent turns verbatim plus a rolling summary, per user (MEMORY_TOKEN_BUDGET=0 disables)
+MEMORY_TOKEN_BUDGET: int = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))  # estimated tokens of history per prompt
+MEMORY_SUMMARY_TOKENS: int = int(os.getenv("MEMORY_SUMMARY_TOKENS", "400"))  # part of the budget for the summary
+MEMORY_MAX_USERS: int = int(os.getenv("MEMORY_MAX_USERS", "10000"))
+MEMORY_MAX_BYTES: int = int(os.getenv("MEMORY_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Messages from one chat arriving less than DEBOUNCE_QUIET_PERIOD apart are answered together (0 disables)
+DEBOUNCE_QUIET_PERIOD: float = float(os.getenv("DEBOUNCE_QUIET_PERIOD", "1.5"))  # seconds
+DEBOUNCE_MAX_DELAY: float = float(os.getenv("DEBOUNCE_MAX_DELAY", "6"))  # seconds after the first message
+
+# Local FAQ answered without Gemini: a JSON list of {"id", "questions", "answer"} (empty FAQ_PATH disables)
+FAQ_PATH: str = os.getenv("FAQ_PATH", "data/faq.json")
+FAQ_MIN_SCORE: float = float(os.getenv("FAQ_MIN_SCORE", "0.5"))  # share of the question matched, see bot.faq
 
 # Bot behavior configuration
 DEFAULT_RESPONSE_ENABLED: bool = os.getenv("DEFAULT_RESPONSE_ENABLED", "true").lower() == "true"
+# Greetings and thanks of up to this many words are answered locally, without Gemini (0 disables)
+QUICK_REPLY_MAX_WORDS: int = int(os.getenv("QUICK_REPLY_MAX_WORDS", "4"))
 WELCOME_MESSAGE: str = os.getenv("WELCOME_MESSAGE", 
     "👋 Welcome! I'm your friendly Telegram bot. Use /help to see available commands.")
 
@@ -46,5 +167,9 @@ def validate_config() -> bool:
     if len(BOT_TOKEN) < 10:
         print("Error: TELEGRAM_BOT_TOKEN appears to be invalid")
         return False
+
+    if BOT_MODE not in ("webhook", "polling"):
+        print(f"Error: BOT_MODE must be webhook or polling, not {BOT_MODE!r}")
+        return False
     
     return True
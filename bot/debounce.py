@@ -0,0 +1,135 @@
+"""
+Per-chat coalescing of rapid-fire messages.
+Fragments typed in quick succession are answered once, as a single prompt.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _ChatState:
+    __slots__ = ("fragments", "generation", "first_at", "task", "taken", "batch")
+
+    def __init__(self) -> None:
+        self.fragments: List[str] = []
+        self.generation = 0
+        self.first_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None  # answer that may still be superseded
+        self.taken = 0  # fragments included in that answer's prompt
+        self.batch: Optional[asyncio.Future] = None  # done once the fragments collected so far are answered
+
+
+class MessageDebouncer:
+    """
+    Joins messages from one chat that arrive less than `quiet_period`
+    seconds apart into one prompt.
+
+    Every message calls submit(); only the call for the latest fragment
+    runs `answer`. The earlier calls wait until that answer is done and
+    return None, so whoever awaits a submit() knows its message has been
+    answered once it returns. A fragment that arrives
+    while an answer is being prepared cancels it, and the new answer covers
+    all fragments. Once the answer calls commit() (just before its first
+    message goes out) it can no longer be superseded, and later fragments
+    start a new batch. No batch waits more than `max_delay` seconds after
+    its first fragment. A `quiet_period` of 0 answers every message on its own.
+    """
+
+    def __init__(self, quiet_period: float, max_delay: float) -> None:
+        self.quiet_period = quiet_period
+        self.max_delay = max(max_delay, quiet_period)
+        self._chats: Dict[Hashable, _ChatState] = {}
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    async def submit(self, chat_id: Hashable, text: str, answer: Callable[[str], Awaitable[T]],
+                     on_queued: Optional[Callable[[], None]] = None) -> Optional[T]:
+        """
+        Add a fragment and, if no newer one arrives, answer the joined prompt.
+        Returns the answer's result, or None when a newer fragment took over,
+        in both cases once the prompt holding this fragment is answered.
+        `on_queued` is called as soon as the fragment has its place in the
+        batch, before the quiet period starts.
+        """
+        if self.quiet_period <= 0:
+            return await answer(text)
+
+        loop = asyncio.get_running_loop()
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatState()
+        if state.task is not None:
+            # The pending answer is now incomplete: drop it, its fragments stay in the batch
+            state.task.cancel()
+            state.task = None
+            metrics.DEBOUNCE_SUPERSEDED.inc()
+        state.fragments.append(text)
+        state.generation += 1
+        generation = state.generation
+        if state.first_at is None:
+            state.first_at = loop.time()
+        if state.batch is None:
+            state.batch = loop.create_future()
+        batch = state.batch
+        if on_queued is not None:
+            on_queued()
+
+        task = None
+        try:
+            await asyncio.sleep(max(0.0, min(self.quiet_period, state.first_at + self.max_delay - loop.time())))
+            if state.generation != generation:
+                # The call of the newest fragment answers this one too
+                await asyncio.shield(batch)
+                return None
+
+            if len(state.fragments) > 1:
+                logger.info(f"Merged {len(state.fragments)} messages from chat {chat_id} into one prompt")
+                metrics.DEBOUNCE_MERGED.inc(len(state.fragments) - 1)
+            task = asyncio.create_task(answer("\n".join(state.fragments)))
+            state.task = task
+            state.taken = len(state.fragments)
+            try:
+                return await task
+            except asyncio.CancelledError:
+                if task.cancelled() and not asyncio.current_task().cancelling():
+                    # Superseded by a newer fragment, whose answer covers this batch
+                    await asyncio.shield(batch)
+                    return None
+                raise
+        finally:
+            if task is not None and state.task is task:
+                self._consume(state)
+            elif task is None and state.generation == generation and state.batch is batch:
+                # Cancelled before answering, and no newer fragment will: the batch is dropped
+                state.fragments.clear()
+                state.first_at = None
+                state.batch = None
+            if state.batch is not batch and not batch.done():
+                # This call answered the batch (or gave up on it): release the calls waiting for it
+                batch.set_result(None)
+            if not state.fragments and state.task is None and self._chats.get(chat_id) is state:
+                del self._chats[chat_id]
+
+    def commit(self, chat_id: Hashable) -> None:
+        """
+        Called from inside an answer before it sends anything:
+        from now on it is final and newer fragments form the next batch.
+        """
+        state = self._chats.get(chat_id)
+        if state is not None and state.task is not None and state.task is asyncio.current_task():
+            self._consume(state)
+
+    def _consume(self, state: _ChatState) -> None:
+        del state.fragments[:state.taken]
+        state.taken = 0
+        state.task = None
+        state.batch = None
+        state.first_at = asyncio.get_running_loop().time() if state.fragments else None
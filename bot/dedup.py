@@ -0,0 +1,138 @@
+"""
+Deduplication of incoming updates by update_id.
+Telegram re-delivers an update when the webhook answers too slowly; the copy must not be answered again.
+"""
+
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Telegram restarts update numbering only after a week without updates; a day of silence is a safe sign of it
+_RESTART_GAP = 24 * 3600  # seconds
+
+# Update ids are Bot API Integers, which fit in a signed 32-bit number
+MAX_UPDATE_ID = 2 ** 31 - 1
+
+
+def valid_update_id(update_id: object) -> bool:
+    """
+    Whether `update_id` can be a real update id; check before is_duplicate() and record().
+    """
+    return isinstance(update_id, int) and not isinstance(update_id, bool) and 0 <= update_id <= MAX_UPDATE_ID
+
+
+class UpdateDeduplicator:
+    """
+    Remembers which of the last `window` update ids have been accepted.
+
+    Telegram numbers updates sequentially, so the state is the highest id
+    seen plus a bitmap of the `window` ids below it: a fixed `window` bits
+    however long the bot runs. Updates may arrive out of order within the
+    window; an older straggler is let through without being remembered.
+    Telegram restarts the numbering at a random value after a week without
+    updates, so after a long silence a lower id starts a new window.
+
+    With `state_path`, the highest id and the time of the last update are
+    written there at most every `flush_interval` seconds and on close(),
+    and read back on start: re-deliveries of updates accepted before a
+    restart are dropped as well.
+    A `window` of 0 disables deduplication.
+    """
+
+    def __init__(self, window: int, state_path: Optional[str] = None, flush_interval: float = 1.0) -> None:
+        self.window = max(0, window)
+        self.state_path = state_path
+        self.flush_interval = flush_interval
+        self._mask = (1 << self.window) - 1
+        self._high: Optional[int] = None
+        self._bits = 0  # bit n set: update `_high - n` was accepted
+        self._last_at = 0.0  # wall-clock time of the last accepted update
+        self._dirty = False
+        self._saved_at = 0.0
+
+        self.duplicates = 0
+
+        if self.enabled and state_path:
+            self._load()
+            if self._high is not None:
+                # Which ids below the mark were seen is lost; assume all of them were
+                self._bits = self._mask
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """
+        Whether an update with this id has already been accepted.
+        """
+        if not self.enabled or self._high is None:
+            return False
+        offset = self._high - update_id
+        if offset < 0 or offset >= self.window:
+            return False
+        if self._bits >> offset & 1:
+            self.duplicates += 1
+            return True
+        return False
+
+    def record(self, update_id: int) -> None:
+        """
+        Mark an update as accepted. Call it only once the update is queued,
+        so one that was refused can still be delivered again.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        if self._high is None or update_id > self._high:
+            shift = update_id - self._high if self._high is not None else self.window
+            # A jump past the whole window forgets every bit, without building a bitmap as long as the jump
+            self._bits = (self._bits << shift | 1) & self._mask if shift < self.window else 1
+            self._high = update_id
+        elif self._high - update_id < self.window:
+            self._bits |= 1 << (self._high - update_id)
+        elif now - self._last_at > _RESTART_GAP:
+            logger.info(f"Update numbering restarted at {update_id} (was {self._high})")
+            self._bits = 1
+            self._high = update_id
+        self._last_at = now
+        self._maybe_save()
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        return {"high": self._high, "duplicates": self.duplicates}
+
+    def close(self) -> None:
+        """
+        Write the final state.
+        """
+        if self.state_path and self._high is not None and self._dirty:
+            self._save()
+
+    def _maybe_save(self) -> None:
+        self._dirty = True
+        if self.state_path and time.monotonic() - self._saved_at >= self.flush_interval:
+            self._save()
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, encoding="ascii") as f:
+                high, last_at = f.read().split()
+            self._high, self._last_at = int(high), float(last_at)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable update id state {self.state_path}: {e}")
+
+    def _save(self) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="ascii") as f:
+                f.write(f"{self._high} {self._last_at:.0f}")
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Failed to save update id state to {self.state_path}: {e}")
+        self._dirty = False
+        self._saved_at = time.monotonic()
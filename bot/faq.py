@@ -0,0 +1,243 @@
+"""
+Local FAQ knowledge base.
+Curated questions are indexed at startup in an inverted index; routine questions are answered by BM25 lookup without Gemini.
+"""
+
+import functools
+import json
+import logging
+import math
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[a-zа-я0-9]+")
+
+# Frequent function words; they would only add noise to the scores
+_STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас ведь во вот все всего всех вы где да даже для до его ее ей
+ему если есть еще же за здесь и из или им их к как какая какие каким какими каких каков какое какой каком
+какую ко когда кто ли либо мне мной мы на над нам
+нас не него нее нет ни них но ну о об от оно она они он по под при про с со так также там тебе тебя то
+тогда того тоже только том ты у уже хоть чего чем что чтобы чтоб эта эти это этого этой этом этот эту я
+""".split())
+
+# Snowball Russian stemmer (https://snowballstem.org/algorithms/russian/stemmer.html)
+_VOWELS = "аеиоуыэюя"
+_PERFECTIVE_GERUND = re.compile(r"(?:(?<=[ая])(?:в|вши|вшись)|ив|ивши|ившись|ыв|ывши|ывшись)$")
+_REFLEXIVE = re.compile(r"(?:ся|сь)$")
+_ADJECTIVAL = re.compile(
+    r"(?:(?<=[ая])(?:ем|нн|вш|ющ|щ)|ивш|ывш|ующ)?"
+    r"(?:ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_VERB = re.compile(
+    r"(?:(?<=[ая])(?:ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)"
+    r"|ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)$")
+_NOUN = re.compile(
+    r"(?:а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$")
+_DERIVATIONAL = re.compile(r"ость?$")
+_SUPERLATIVE = re.compile(r"ейше?$")
+
+
+def _region_start(word: str, start: int) -> int:
+    # Position after the first non-vowel that follows a vowel, searching from `start`
+    for i in range(max(start, 1), len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """
+    Strip the inflectional ending of a lowercase Russian word; other words are returned as is.
+    """
+    rv_start = next((i + 1 for i, char in enumerate(word) if char in _VOWELS), len(word))
+    r2_start = _region_start(word, _region_start(word, 0))
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    match = _PERFECTIVE_GERUND.search(rv)
+    if match:
+        rv = rv[:match.start()]
+    else:
+        rv = _REFLEXIVE.sub("", rv)
+        for pattern in (_ADJECTIVAL, _VERB, _NOUN):
+            match = pattern.search(rv)
+            if match:
+                rv = rv[:match.start()]
+                break
+    if rv.endswith("и"):
+        rv = rv[:-1]
+    match = _DERIVATIONAL.search(rv)
+    if match and rv_start + match.start() >= r2_start:
+        rv = rv[:match.start()]
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        match = _SUPERLATIVE.search(rv)
+        if match:
+            rv = rv[:match.start()]
+            if rv.endswith("нн"):
+                rv = rv[:-1]
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def terms(text: str) -> List[str]:
+    """
+    Index terms of a text: lowercase word stems, 'ё' read as 'е', stop words dropped.
+    """
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return [stem(word) for word in words if word not in _STOP_WORDS]
+
+
+class FaqIndex:
+    """
+    BM25 index over the questions of a curated FAQ.
+
+    Every question variant of an entry is a document of its own; an entry
+    scores as its best-matching variant. The score is divided by the total
+    IDF of the query's terms, so it reads roughly as the share of the
+    question's weight found in the entry, whatever the question's length:
+    a long message that merely mentions a topic stays below `min_score`
+    and goes to Gemini. A match on a single query term counts only when
+    that term belongs to one entry alone: "цена" names a question, while
+    "тату" or "мастер" could be about any of several and go to Gemini.
+    An entry may list "keywords" that name it on their own all the same,
+    like "заживает" for the healing time rather than the itching of a
+    healing tattoo. Short questions can score somewhat above 1.
+
+    Entries are dicts with "id", "questions" and "answer", optionally "keywords".
+    """
+
+    def __init__(self, entries: Sequence[Dict], min_score: float, k1: float = 1.2, b: float = 0.75) -> None:
+        self.min_score = min_score
+        self.k1 = k1
+        self.b = b
+        self._ids: List[str] = []
+        self._answers: List[str] = []
+        self._doc_entries: List[int] = []  # document -> entry index
+        self._doc_lengths: List[int] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}  # term -> [(document, term frequency)]
+        self._keywords: Dict[str, int] = {}  # term -> entry it names on its own
+
+        for entry in entries:
+            entry_index = len(self._ids)
+            self._ids.append(entry["id"])
+            self._answers.append(entry["answer"])
+            for keyword in entry.get("keywords", ()):
+                for term in terms(keyword):
+                    self._keywords[term] = entry_index
+            for question in entry["questions"]:
+                doc_terms = terms(question)
+                if not doc_terms:
+                    continue
+                doc = len(self._doc_lengths)
+                self._doc_entries.append(entry_index)
+                self._doc_lengths.append(len(doc_terms))
+                for term, count in Counter(doc_terms).items():
+                    self._postings.setdefault(term, []).append((doc, count))
+
+        documents = len(self._doc_lengths)
+        self._average_length = sum(self._doc_lengths) / documents if documents else 0.0
+        self._idf = {term: self._term_idf(len(postings)) for term, postings in self._postings.items()}
+        self._term_entries = {term: len({self._doc_entries[doc] for doc, _ in postings})
+                              for term, postings in self._postings.items()}
+        # A term no document contains weighs as much as the rarest possible one
+        self._unknown_idf = self._term_idf(0)
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: Optional[str], min_score: float) -> "FaqIndex":
+        """
+        Build the index from a JSON file with a list of entries.
+        A missing or broken file gives an empty index, so the bot still starts.
+        """
+        entries: List[Dict] = []
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entries = json.load(f)
+            except FileNotFoundError:
+                logger.warning(f"FAQ file {path} not found, FAQ answers are disabled")
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load FAQ from {path}: {e}")
+        try:
+            index = cls(entries, min_score)
+        except (KeyError, TypeError) as e:
+            logger.error(f"Malformed FAQ entry in {path}: {e}")
+            index = cls([], min_score)
+        if entries:
+            logger.info(f"Loaded {len(index)} FAQ entries, {len(index._postings)} terms")
+        return index
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _term_idf(self, document_frequency: int) -> float:
+        documents = len(self._doc_lengths)
+        return math.log(1 + (documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, text: str) -> Optional[Tuple[str, float]]:
+        """
+        Id and normalized score of the best-matching entry, or None if nothing matches.
+        """
+        best = self._best(text)
+        return (self._ids[best[0]], best[1]) if best is not None else None
+
+    def _best(self, text: str) -> Optional[Tuple[int, float]]:
+        query = set(terms(text))
+        if not query or not self._doc_lengths:
+            return None
+        k1, b, average_length = self.k1, self.b, self._average_length
+        scores: Dict[int, float] = {}
+        for term in query:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            idf = self._idf[term]
+            for doc, frequency in postings:
+                norm = k1 * (1 - b + b * self._doc_lengths[doc] / average_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+        if not scores:
+            return None
+        matched = [term for term in query if term in self._postings]
+        if len(matched) == 1 and self._term_entries[matched[0]] > 1:
+            keyword_entry = self._keywords.get(matched[0])
+            if keyword_entry is None:
+                return None
+            scores = {doc: score for doc, score in scores.items() if self._doc_entries[doc] == keyword_entry}
+            if not scores:
+                return None
+        best_doc = max(scores, key=scores.__getitem__)
+        weight = sum(self._idf.get(term, self._unknown_idf) for term in query)
+        return self._doc_entries[best_doc], scores[best_doc] / weight
+
+    def answer(self, text: str) -> Optional[str]:
+        """
+        The answer of the best entry if its score reaches `min_score`, None otherwise.
+        """
+        if not self._ids:
+            return None
+        started = time.perf_counter()
+        best = self._best(text)
+        metrics.FAQ_LOOKUP_SECONDS.observe(time.perf_counter() - started)
+        if best is None or best[1] < self.min_score:
+            self.misses += 1
+            metrics.FAQ_MISSES.inc()
+            return None
+        entry, score = best
+        self.hits += 1
+        metrics.FAQ_HITS.inc()
+        logger.info(f"FAQ answer {self._ids[entry]} (score {score:.2f})")
+        return self._answers[entry]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._ids), "terms": len(self._postings), "hits": self.hits, "misses": self.misses}
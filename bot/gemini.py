@@ -0,0 +1,483 @@
+"""
+Asynchronous access layer for the Gemini API.
+Bounds concurrent requests, applies per-call timeouts and turns SDK failures into typed errors.
+Retryable failures are retried, a failing model is cut off by a circuit breaker and a fallback model can take over.
+The static system prompt can be served from Gemini's context cache.
+The SDK takes about a second to import, so it is only loaded when first needed.
+"""
+
+import asyncio
+import contextlib
+import datetime
+import itertools
+import logging
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Optional, Tuple
+
+from . import metrics
+from .admission import INTERACTIVE, AdmissionController, AdmissionRejected
+from .resilience import CircuitBreaker, backoff_delay
+
+if TYPE_CHECKING:
+    from google.generativeai import caching
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiError(Exception):
+    """
+    Base class for all Gemini failures.
+    `retryable` tells callers whether repeating the same request may succeed;
+    `kind` is a short name for metrics.
+    """
+
+    retryable: bool = False
+    kind: str = "other"
+
+
+class GeminiQuotaError(GeminiError):
+    """Request quota or rate limit exhausted (HTTP 429)."""
+
+    retryable = True
+    kind = "quota"
+
+
+class GeminiAuthError(GeminiError):
+    """API key is missing, invalid or lacks permissions."""
+
+    kind = "auth"
+
+
+class GeminiTimeoutError(GeminiError):
+    """The call did not finish within the configured timeout."""
+
+    retryable = True
+    kind = "timeout"
+
+
+class GeminiUnavailableError(GeminiError):
+    """Upstream is temporarily unavailable (5xx)."""
+
+    retryable = True
+    kind = "unavailable"
+
+
+class GeminiBusyError(GeminiError):
+    """The request was shed by admission control because the queue is overloaded."""
+
+    retryable = True
+    kind = "busy"
+
+
+class GeminiCircuitOpenError(GeminiError):
+    """Gemini has been failing; calls fail fast until the circuit breaker lets a probe through."""
+
+    kind = "circuit_open"
+
+
+class GeminiEmptyResponseError(GeminiError):
+    """The model returned no text, e.g. the answer was blocked."""
+
+    kind = "empty"
+
+
+def classify_error(error: Exception) -> GeminiError:
+    """
+    Map an exception raised by the SDK to a typed GeminiError.
+    """
+    if isinstance(error, GeminiError):
+        return error
+    from google.api_core import exceptions as google_exceptions
+
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return GeminiQuotaError(str(error))
+    if isinstance(error, (google_exceptions.Unauthenticated, google_exceptions.Unauthorized,
+                          google_exceptions.PermissionDenied, google_exceptions.Forbidden)):
+        return GeminiAuthError(str(error))
+    if isinstance(error, (asyncio.TimeoutError, google_exceptions.DeadlineExceeded,
+                          google_exceptions.GatewayTimeout)):
+        return GeminiTimeoutError(str(error) or "Gemini request timed out")
+    if isinstance(error, (google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                          google_exceptions.BadGateway)):
+        return GeminiUnavailableError(str(error))
+    return GeminiError(str(error))
+
+
+def _count_error(error: GeminiError) -> GeminiError:
+    metrics.GEMINI_ERRORS.labels(error.kind).inc()
+    return error
+
+
+def log_usage(response: Any) -> None:
+    """
+    Log the token counts reported for a finished response.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    logger.info(
+        f"Gemini tokens: prompt={usage.prompt_token_count} "
+        f"cached={usage.cached_content_token_count} output={usage.candidates_token_count}")
+
+
+class GeminiClient:
+    """
+    Non-blocking wrapper around a GenerativeModel.
+    At most `max_concurrency` requests are in flight; up to `max_queue` more
+    wait in priority order, and requests that would wait longer than
+    `queue_slo` seconds are shed with GeminiBusyError (see AdmissionController).
+
+    Retryable failures are retried up to `retries` times with jittered
+    exponential backoff, as long as the retry starts within `timeout` of
+    the first attempt. Each model sits behind a CircuitBreaker, so while it
+    keeps failing calls fail fast with GeminiCircuitOpenError instead of
+    piling onto it. When the primary model is throttled or its circuit is
+    open, the request goes to `fallback_model` if one is given.
+    A non-streamed call still unanswered after `hedge_after` seconds is
+    duplicated if an admission slot is free for the copy, and the first
+    answer wins (0 disables hedging).
+    """
+
+    def __init__(self, model: Any, max_concurrency: int, timeout: float,
+                 max_queue: int = 64, queue_slo: float = 0.0, fallback_model: Any = None,
+                 retries: int = 0, retry_base_delay: float = 0.5, retry_max_delay: float = 4.0,
+                 breaker_threshold: int = 0, breaker_reset: float = 30.0, hedge_after: float = 0.0) -> None:
+        self.model = model
+        self.fallback_model = fallback_model
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_after = hedge_after
+        self.admission = AdmissionController(self.max_concurrency, max_queue, queue_slo)
+        self.breaker = CircuitBreaker("gemini-primary", breaker_threshold, breaker_reset)
+        self.fallback_breaker = CircuitBreaker("gemini-fallback", breaker_threshold, breaker_reset)
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Number of requests currently sent to Gemini."""
+        return self._in_flight
+
+    @contextlib.asynccontextmanager
+    async def _admitted(self, priority: int) -> AsyncIterator[None]:
+        try:
+            async with self.admission.slot(priority):
+                yield
+        except AdmissionRejected as e:
+            raise _count_error(GeminiBusyError(str(e))) from e
+
+    def _routes(self) -> List[Tuple[str, Any, CircuitBreaker]]:
+        routes = [("primary", self.model, self.breaker)]
+        if self.fallback_model is not None:
+            routes.append(("fallback", self.fallback_model, self.fallback_breaker))
+        return routes
+
+    @staticmethod
+    def _record(breaker: CircuitBreaker, error: Optional[GeminiError]) -> None:
+        if error is None or isinstance(error, GeminiEmptyResponseError):
+            # The upstream answered; an empty answer is about the prompt, not its health
+            breaker.record_success()
+        elif error.retryable:
+            breaker.record_failure()
+        else:
+            breaker.release()
+
+    async def _retry_wait(self, error: GeminiError, attempt: int, deadline: float) -> bool:
+        """
+        Sleep before the next attempt if `error` deserves one. Returns False to give up.
+        """
+        if not error.retryable or attempt >= self.retries:
+            return False
+        delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+        if time.monotonic() + delay > deadline:
+            return False
+        metrics.GEMINI_RETRIES.inc()
+        logger.info(f"Retrying Gemini request in {delay:.2f}s after {error.kind} error: {error}")
+        await asyncio.sleep(delay)
+        return True
+
+    async def generate(self, contents: Any, priority: int = INTERACTIVE) -> str:
+        """
+        Generate a reply for `contents` and return its text.
+        Cancelling the calling task cancels the upstream request as well.
+        Raises a GeminiError subclass on failure.
+        """
+        async with self._admitted(priority):
+            deadline = time.monotonic() + self.timeout
+            for attempt in itertools.count():
+                try:
+                    return await self._hedged(contents)
+                except GeminiError as e:
+                    if not await self._retry_wait(e, attempt, deadline):
+                        raise
+
+    async def _hedged(self, contents: Any) -> str:
+        if self.hedge_after <= 0:
+            return await self._generate_routed(contents)
+        first = asyncio.ensure_future(self._generate_routed(contents))
+        pending = {first}
+        hedge: Optional[asyncio.Future] = None
+        error: Optional[BaseException] = None
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return first.result()
+            # The hedge needs a free admission slot of its own, so it never pushes Gemini past the limit
+            if self.admission.try_acquire():
+                metrics.GEMINI_HEDGES.labels("sent").inc()
+                hedge = asyncio.ensure_future(self._generate_routed(contents))
+                hedge.add_done_callback(lambda task: self.admission.release())
+                pending.add(hedge)
+            else:
+                metrics.GEMINI_HEDGES.labels("skipped").inc()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        if task is hedge:
+                            metrics.GEMINI_HEDGES.labels("won").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error or asyncio.CancelledError()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _generate_routed(self, contents: Any) -> str:
+        error: Optional[GeminiError] = None
+        for route, model, breaker in self._routes():
+            if not breaker.allow():
+                continue
+            if route == "fallback":
+                metrics.GEMINI_FALLBACKS.inc()
+            try:
+                text = await self._generate_once(model, contents)
+            except GeminiError as e:
+                self._record(breaker, e)
+                if isinstance(e, GeminiQuotaError):
+                    # Throttled: the fallback model has its own quota
+                    error = e
+                    continue
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            self._record(breaker, None)
+            return text
+        raise error or _count_error(GeminiCircuitOpenError("Gemini is failing, circuit open"))
+
+    async def _generate_once(self, model: Any, contents: Any) -> str:
+        self._in_flight += 1
+        metrics.GEMINI_REQUESTS.inc()
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                model.generate_content_async(
+                    contents, request_options={"timeout": self.timeout}),
+                self.timeout,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise _count_error(classify_error(e)) from e
+        finally:
+            self._in_flight -= 1
+            metrics.GEMINI_SECONDS.observe(time.perf_counter() - started)
+
+        log_usage(response)
+        try:
+            text = response.text
+        except ValueError as e:
+            raise _count_error(GeminiEmptyResponseError(str(e))) from e
+        if not text:
+            raise _count_error(GeminiEmptyResponseError("Gemini returned an empty response"))
+        return text
+
+    async def stream(self, contents: Any, priority: int = INTERACTIVE) -> AsyncIterator[str]:
+        """
+        Generate a reply for `contents` and yield its text as it arrives.
+        The timeout applies to the wait for each chunk, not to the whole stream.
+        Failures are retried only until the first text arrives; streams are not hedged.
+        Raises a GeminiError subclass on failure.
+
+        A task of its own reads the stream into a buffer, so the admission
+        slot is given back as soon as Gemini is done, however long the
+        caller spends on each piece (editing a Telegram message, say).
+        """
+        deltas: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        reader = asyncio.ensure_future(self._read_stream(contents, priority, deltas))
+        try:
+            while True:
+                text = await deltas.get()
+                if text is None:
+                    break
+                yield text
+            # Raises the error that ended the stream, if any
+            await reader
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+    async def _read_stream(self, contents: Any, priority: int, deltas: "asyncio.Queue[Optional[str]]") -> None:
+        try:
+            async with self._admitted(priority):
+                deadline = time.monotonic() + self.timeout
+                for attempt in itertools.count():
+                    produced = False
+                    try:
+                        async with contextlib.aclosing(self._stream_routed(contents)) as stream:
+                            async for text in stream:
+                                produced = True
+                                deltas.put_nowait(text)
+                        return
+                    except GeminiError as e:
+                        if produced or not await self._retry_wait(e, attempt, deadline):
+                            raise
+        finally:
+            # End of stream, whether it succeeded or not
+            deltas.put_nowait(None)
+
+    async def _stream_routed(self, contents: Any) -> AsyncIterator[str]:
+        error: Optional[GeminiError] = None
+        for route, model, breaker in self._routes():
+            if not breaker.allow():
+                continue
+            if route == "fallback":
+                metrics.GEMINI_FALLBACKS.inc()
+            produced = False
+            try:
+                async with contextlib.aclosing(self._stream_once(model, contents)) as deltas:
+                    async for text in deltas:
+                        produced = True
+                        yield text
+            except GeminiError as e:
+                self._record(breaker, e)
+                if isinstance(e, GeminiQuotaError) and not produced:
+                    error = e
+                    continue
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            self._record(breaker, None)
+            return
+        raise error or _count_error(GeminiCircuitOpenError("Gemini is failing, circuit open"))
+
+    async def _stream_once(self, model: Any, contents: Any) -> AsyncIterator[str]:
+        self._in_flight += 1
+        metrics.GEMINI_REQUESTS.inc()
+        started = time.perf_counter()
+        try:
+            try:
+                response = await asyncio.wait_for(
+                    model.generate_content_async(
+                        contents, stream=True, request_options={"timeout": self.timeout}),
+                    self.timeout,
+                )
+                chunks = response.__aiter__()
+                produced = False
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Service chunks (e.g. the final finish_reason) carry no text
+                        continue
+                    if text:
+                        produced = True
+                        yield text
+            except asyncio.CancelledError:
+                raise
+            except GeminiError as e:
+                raise _count_error(e)
+            except Exception as e:
+                raise _count_error(classify_error(e)) from e
+            if not produced:
+                raise _count_error(GeminiEmptyResponseError("Gemini returned an empty response"))
+            log_usage(response)
+        finally:
+            self._in_flight -= 1
+            metrics.GEMINI_SECONDS.observe(time.perf_counter() - started)
+
+
+class PromptCache:
+    """
+    Serves the system instruction from a Gemini cached-content handle.
+    The handle's TTL is extended in the background before it expires.
+    If caching is unavailable, the client keeps using its original model,
+    which carries the same text as a plain system_instruction.
+    """
+
+    def __init__(self, client: GeminiClient, model_name: str, system_instruction: str,
+                 ttl: float, refresh_margin: float) -> None:
+        self.client = client
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.fallback_model = client.model
+        self._cached: Optional["caching.CachedContent"] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Create the cached content and start the refresh task.
+        """
+        await self._create()
+        self._task = asyncio.create_task(self._refresh_loop(), name="gemini-prompt-cache")
+
+    async def stop(self) -> None:
+        """
+        Stop refreshing and delete the cached content.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._cached is not None:
+            try:
+                await asyncio.to_thread(self._cached.delete)
+            except Exception as e:
+                logger.warning(f"Failed to delete cached prompt: {e}")
+            self._cached = None
+        self.client.model = self.fallback_model
+
+    async def _create(self) -> None:
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        try:
+            cached = await asyncio.to_thread(
+                caching.CachedContent.create,
+                model=self.model_name,
+                display_name="system-prompt",
+                system_instruction=self.system_instruction,
+                ttl=datetime.timedelta(seconds=self.ttl),
+            )
+        except Exception as e:
+            logger.warning(f"Context caching unavailable, sending system instruction with each request: {e}")
+            self._cached = None
+            self.client.model = self.fallback_model
+            return
+        self._cached = cached
+        self.client.model = genai.GenerativeModel.from_cached_content(cached)
+        logger.info(f"System prompt cached as {cached.name}, {cached.usage_metadata.total_token_count} tokens")
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl - self.refresh_margin)
+            if self._cached is None:
+                await self._create()
+                continue
+            try:
+                await asyncio.to_thread(self._cached.update, ttl=datetime.timedelta(seconds=self.ttl))
+            except Exception as e:
+                logger.warning(f"Failed to extend cached prompt, recreating it: {e}")
+                await self._create()
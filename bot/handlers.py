@@ -3,38 +3,68 @@ Message handlers for the Telegram bot.
 This module contains handlers for different types of messages and events.
 """
 
+import asyncio
 import logging
-import time
-from collections import defaultdict
+from typing import Optional, Union
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from .config import DEFAULT_RESPONSE_ENABLED, RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW
+from .config import (
+    DEFAULT_RESPONSE_ENABLED, RATE_LIMIT_BACKEND, RATE_LIMIT_DB,
+    RATE_LIMIT_MESSAGES, RATE_LIMIT_SWEEP_INTERVAL, RATE_LIMIT_WINDOW, SQLITE_BUSY_TIMEOUT,
+)
+from .intents import IntentMatcher
+from .ratelimit import MemoryRateLimiter, SQLiteRateLimiter
 
 logger = logging.getLogger(__name__)
 
-# Simple rate limiting storage
-user_message_times = defaultdict(list)
+# Rate limiting storage: one timestamp per active user, optionally shared via SQLite.
+# Created on first use, so importing this module does not open the database.
+_rate_limiter: Optional[Union[MemoryRateLimiter, SQLiteRateLimiter]] = None
+
+
+def get_rate_limiter() -> Union[MemoryRateLimiter, SQLiteRateLimiter]:
+    global _rate_limiter
+    if _rate_limiter is None:
+        if RATE_LIMIT_BACKEND == "sqlite":
+            _rate_limiter = SQLiteRateLimiter(RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW, RATE_LIMIT_DB,
+                                              busy_timeout=SQLITE_BUSY_TIMEOUT)
+        else:
+            _rate_limiter = MemoryRateLimiter(RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW)
+    return _rate_limiter
+
+
+# Keyword tables in priority order, compiled once into a single matcher
+KEYWORD_INTENTS = {
+    'greeting': ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening'],
+    'farewell': ['bye', 'goodbye', 'see you', 'farewell', 'take care'],
+    'question': ['what', 'how', 'when', 'where', 'why', 'who', '?'],
+    'thanks': ['thank', 'thanks', 'appreciate', 'grateful'],
+    'help': ['help', 'assist', 'support', 'guidance'],
+    'bot': ['bot', 'robot', 'ai', 'artificial'],
+}
+
+KEYWORD_RESPONSES = {
+    'farewell': "Goodbye! 👋 Feel free to message me anytime!",
+    'question': "That's a great question! While I'm a simple bot, you can use /help to see what I can do for you.",
+    'thanks': "You're very welcome! I'm happy to help! 😊",
+    'help': "I'd be happy to help! Use /help to see all available commands, or just tell me what you need.",
+    'bot': "Yes, I'm a Telegram bot! I'm here to assist you. Use /help to see what I can do!",
+}
+
+response_matcher = IntentMatcher(KEYWORD_INTENTS)
 
 
-def is_rate_limited(user_id: int) -> bool:
+async def is_rate_limited(user_id: int) -> bool:
     """
     Check if user is rate limited.
     Returns True if user has exceeded rate limit, False otherwise.
     """
-    current_time = time.time()
-    user_times = user_message_times[user_id]
-    
-    # Remove old timestamps outside the window
-    user_times[:] = [t for t in user_times if current_time - t < RATE_LIMIT_WINDOW]
-    
-    # Check if user has exceeded rate limit
-    if len(user_times) >= RATE_LIMIT_MESSAGES:
-        return True
-    
-    # Add current timestamp
-    user_times.append(current_time)
-    return False
+    rate_limiter = get_rate_limiter()
+    if isinstance(rate_limiter, SQLiteRateLimiter):
+        return await rate_limiter.run(rate_limiter.is_limited, user_id, default=False)
+    return rate_limiter.is_limited(user_id)
 
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -47,7 +77,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         message_text = update.message.text.lower().strip()
         
         # Rate limiting check
-        if is_rate_limited(user.id):
+        if await is_rate_limited(user.id):
             logger.warning(f"Rate limit exceeded for user {user.id}")
             await update.message.reply_text(
                 "⚠️ You're sending messages too quickly. Please wait a moment before sending another message."
@@ -80,38 +110,14 @@ async def generate_response(message_text: str, user) -> str:
     Generate an appropriate response based on the message content.
     This function can be extended to include more sophisticated response logic.
     """
+    intent = response_matcher.match(message_text)
+
     # Greeting responses
-    greetings = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
-    if any(greeting in message_text for greeting in greetings):
+    if intent == 'greeting':
         return f"Hello {user.first_name}! 👋 How can I help you today?"
-    
-    # Farewell responses
-    farewells = ['bye', 'goodbye', 'see you', 'farewell', 'take care']
-    if any(farewell in message_text for farewell in farewells):
-        return "Goodbye! 👋 Feel free to message me anytime!"
-    
-    # Question responses
-    question_words = ['what', 'how', 'when', 'where', 'why', 'who', '?']
-    if any(word in message_text for word in question_words):
-        return "That's a great question! While I'm a simple bot, you can use /help to see what I can do for you."
-    
-    # Thanks responses
-    thanks_words = ['thank', 'thanks', 'appreciate', 'grateful']
-    if any(word in message_text for word in thanks_words):
-        return "You're very welcome! I'm happy to help! 😊"
-    
-    # Help requests
-    help_words = ['help', 'assist', 'support', 'guidance']
-    if any(word in message_text for word in help_words):
-        return "I'd be happy to help! Use /help to see all available commands, or just tell me what you need."
-    
-    # Bot-related queries
-    bot_words = ['bot', 'robot', 'ai', 'artificial']
-    if any(word in message_text for word in bot_words):
-        return "Yes, I'm a Telegram bot! I'm here to assist you. Use /help to see what I can do!"
-    
-    # No specific response triggered
-    return None
+
+    # None when no specific response is triggered
+    return KEYWORD_RESPONSES.get(intent)
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -132,18 +138,27 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 
 # Cleanup function for rate limiting
-def cleanup_rate_limit_data():
+async def cleanup_rate_limit_data():
     """
     Clean up old rate limiting data to prevent memory leaks.
-    Should be called periodically in production.
+    Scheduled by run_rate_limit_cleanup().
     """
-    current_time = time.time()
-    for user_id in list(user_message_times.keys()):
-        user_times = user_message_times[user_id]
-        user_times[:] = [t for t in user_times if current_time - t < RATE_LIMIT_WINDOW]
-        
-        # Remove empty entries
-        if not user_times:
-            del user_message_times[user_id]
-    
-    logger.info(f"Rate limit cleanup completed. Active users: {len(user_message_times)}")
+    rate_limiter = get_rate_limiter()
+    if isinstance(rate_limiter, SQLiteRateLimiter):
+        removed = await rate_limiter.run(rate_limiter.sweep, default=0)
+        active = await rate_limiter.run(rate_limiter.__len__, default=-1)
+    else:
+        removed, active = rate_limiter.sweep(), len(rate_limiter)
+    logger.info(f"Rate limit cleanup completed. Removed: {removed}, active users: {active}")
+
+
+async def run_rate_limit_cleanup(interval: float = RATE_LIMIT_SWEEP_INTERVAL) -> None:
+    """
+    Run cleanup_rate_limit_data() every `interval` seconds until cancelled.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await cleanup_rate_limit_data()
+        except Exception as e:
+            logger.error(f"Rate limit cleanup failed: {e}")
@@ -0,0 +1,153 @@
+"""
+Keyword intent matching.
+Keyword tables are compiled once into a single regular expression, so the intent is found in one scan over a message.
+"""
+
+import re
+from typing import AbstractSet, Dict, Iterable, List, Optional
+
+# Punctuation, symbols and emoji; they separate words like whitespace does
+_SEPARATOR_RANGES = [
+    (0x21, 0x2F), (0x3A, 0x40), (0x5B, 0x60), (0x7B, 0x7E), (0xA1, 0xBF),
+    (0x2000, 0x206F), (0x2190, 0x2BFF), (0x3000, 0x303F), (0x1F000, 0x1FAFF),
+]
+# Whitespace other than the space itself; keywords are looked for after plain spaces only
+_WHITESPACE = [code for code in range(0x3001) if chr(code).isspace() and code != 0x20]
+
+
+def _separator_table(symbols: Iterable[str]) -> Dict[int, str]:
+    """
+    Translation table that turns separators into spaces.
+    Characters listed in `symbols` become standalone tokens instead.
+    """
+    table = {code: " " for start, end in _SEPARATOR_RANGES for code in range(start, end + 1)}
+    table.update(dict.fromkeys(_WHITESPACE, " "))
+    for symbol in symbols:
+        table[ord(symbol)] = f" {symbol} "
+    return table
+
+
+def _trie_pattern(keywords: Iterable[str]) -> str:
+    """
+    Regular expression matching any of `keywords`, shaped as their
+    character trie so the engine never retries a shared beginning.
+    A space matches a run of spaces and a '*' any rest of the word.
+    """
+    root: Dict[str, dict] = {}
+    for keyword in keywords:
+        node = root
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = []
+        for char, child in sorted(node.items()):
+            if char == "*":
+                branches.append(r"\S*")
+            elif char == " ":
+                branches.append(" +" + build(child))
+            elif char:
+                branches.append(re.escape(char) + build(child))
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # A keyword may end here, before the longer ones sharing its beginning
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return build(root)
+
+
+class IntentMatcher:
+    """
+    Matches text against ordered keyword tables.
+    Keywords match whole words only; a trailing '*' makes a keyword a prefix
+    ('благодар*' matches 'благодарю'), multi-word keywords match phrases and
+    single punctuation marks such as '?' match on their own.
+    Intents are given in priority order: when a text contains keywords of
+    several intents, the earliest one wins, as with sequential checks.
+
+    All keywords are compiled into one regular expression that looks ahead
+    at every word, so a single scan finds keywords that overlap too; the
+    few words it finds are then looked up to learn their intent.
+    """
+
+    def __init__(self, intents: Dict[str, Iterable[str]]) -> None:
+        self._names = list(intents)
+        self._keywords: Dict[str, int] = {}  # words joined by single spaces -> intent index
+        self._prefixes: Dict[str, int] = {}
+        symbols = set()
+
+        # Register in reverse so higher-priority intents overwrite shared keywords
+        for index in reversed(range(len(self._names))):
+            for keyword in intents[self._names[index]]:
+                keyword = " ".join(keyword.lower().split())
+                if len(keyword) == 1 and not keyword.isalnum():
+                    symbols.add(keyword)
+                if keyword.endswith("*"):
+                    self._prefixes[keyword.rstrip("*")] = index
+                else:
+                    self._keywords[keyword] = index
+
+        self._table = _separator_table(symbols)
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes})
+        alternatives = list(self._keywords) + [f"{prefix}*" for prefix in self._prefixes]
+        # Zero-width: the longest keyword starting at each word, whether or not it overlaps the previous one.
+        # Words start after a space (the text gets one in front), a literal the engine can skip ahead to.
+        self._pattern = re.compile(rf" (?=({_trie_pattern(alternatives)})(?!\S))") if alternatives else None
+        # What most matches are, resolved up front: a keyword as written
+        self._resolved = {keyword: self._intent(keyword) for keyword in self._keywords}
+
+    def tokenize(self, text: str) -> List[str]:
+        """
+        Split text into lowercase words (and the punctuation keywords).
+        """
+        return text.lower().translate(self._table).split()
+
+    def _intent(self, found: str) -> int:
+        # The longest keyword was found; shorter ones starting at the same word count as well
+        best = len(self._names)
+        words = found.split()
+        for end in range(1, len(words) + 1):
+            best = min(best, self._keywords.get(" ".join(words[:end]), best))
+        first = words[0]
+        for length in self._prefix_lengths:
+            if length > len(first):
+                break
+            best = min(best, self._prefixes.get(first[:length], best))
+        return best
+
+    def match(self, text: str) -> Optional[str]:
+        """
+        Return the highest-priority intent found in `text`, or None.
+        """
+        if self._pattern is None:
+            return None
+        found = self._pattern.findall(" " + text.lower().translate(self._table))
+        if not found:
+            return None
+        resolved = self._resolved
+        return self._names[min(resolved[keyword] if keyword in resolved else self._intent(keyword)
+                               for keyword in found)]
+
+    def match_all(self, text: str, fillers: AbstractSet[str] = frozenset()) -> Optional[str]:
+        """
+        Like match(), but only for a text made up entirely of keywords and
+        `fillers`: any other word means the text says something more, and
+        None is returned.
+        """
+        tokens = [token for token in self.tokenize(text) if token not in fillers]
+        if not tokens or self._pattern is None:
+            return None
+        joined = " " + " ".join(tokens)
+        best = len(self._names)
+        covered = 0  # end of the text covered by keywords so far
+        for found in self._pattern.finditer(joined):
+            if joined[covered:found.start(1)].strip():
+                return None
+            covered = max(covered, found.end(1))
+            keyword = found.group(1)
+            best = min(best, self._resolved[keyword] if keyword in self._resolved else self._intent(keyword))
+        if joined[covered:].strip():
+            return None
+        return self._names[best] if best < len(self._names) else None
@@ -0,0 +1,114 @@
+"""
+Non-blocking logging setup.
+Records are scrubbed and queued on the calling thread; a background listener writes them to the console and a rotating file.
+"""
+
+import atexit
+import logging
+import queue
+import re
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Iterable
+
+_TOKEN_RE = re.compile(r'(https://api\.telegram\.org/(?:file/)?bot)([0-9]+:[\w-]+)')
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+
+def scrub(text: str) -> str:
+    """
+    Replace Telegram bot tokens in API URLs with a placeholder.
+    """
+    if "api.telegram.org" not in text:
+        return text
+    return _TOKEN_RE.sub(r'\1<TELEGRAM_TOKEN>', text)
+
+
+def truncate(text: str, max_length: int) -> str:
+    """
+    Shorten `text` to `max_length` characters, noting how much was cut.
+    """
+    if max_length <= 0 or len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}… (+{len(text) - max_length} chars)"
+
+
+class TokenFilter(logging.Filter):
+    """
+    Removes the Telegram token from the message and its arguments,
+    and truncates long string arguments such as user texts and AI answers.
+    """
+
+    def __init__(self, max_field_length: int = 0) -> None:
+        super().__init__()
+        self.max_field_length = max_field_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str):
+            record.msg = scrub(record.msg)
+        if record.args:
+            if isinstance(record.args, dict):
+                record.args = {key: self._clean(value) for key, value in record.args.items()}
+            else:
+                record.args = tuple(self._clean(value) for value in record.args)
+        return True
+
+    def _clean(self, value):
+        if isinstance(value, str):
+            return truncate(scrub(value), self.max_field_length)
+        if isinstance(value, BaseException):
+            return scrub(str(value))
+        return value
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: when the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(logger_names: Iterable[str], level: str = "INFO", log_file: str = "bot.log",
+                  max_bytes: int = 5 * 1024 * 1024, backup_count: int = 3,
+                  queue_size: int = 10000, max_field_length: int = 300) -> QueueListener:
+    """
+    Route the given loggers through a bounded queue to a background listener.
+    The listener writes to the console and to a size-capped rotating file,
+    and is stopped (flushing pending records) at interpreter exit.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(TokenFilter(max_field_length))
+
+    for name in logger_names:
+        target = logging.getLogger(name)
+        target.setLevel(level)
+        target.addHandler(queue_handler)
+        target.propagate = False
+
+    listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+
+    def stop_listener() -> None:
+        # Tolerate an earlier explicit stop()
+        if listener._thread is not None:
+            listener.stop()
+
+    atexit.register(stop_listener)
+    return listener
@@ -0,0 +1,220 @@
+"""
+Per-user conversation memory with a fixed token budget.
+Recent turns are kept verbatim; older ones are folded into a rolling summary in the background.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (summary so far, [(role, text), ...] to fold into it) -> new summary
+Summarizer = Callable[[str, List[Tuple[str, str]]], Awaitable[str]]
+
+USER = "user"
+MODEL = "model"
+
+_SUMMARY_PREFIX = "Краткое содержание нашего прошлого разговора:\n"
+_SUMMARY_ACK = "Помню."
+ROLE_NAMES = {USER: "Клиент", MODEL: "Демон"}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap upper estimate of the token count: about one token per four UTF-8 bytes.
+    Cyrillic takes two bytes per letter, so Russian text is counted generously.
+    """
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def clip(text: str, tokens: int, keep_end: bool = False) -> str:
+    """
+    Cut `text` to roughly `tokens` estimated tokens on a character boundary.
+    """
+    limit = tokens * 4
+    data = text.encode("utf-8")
+    if len(data) <= limit:
+        return text
+    if keep_end:
+        return "…" + data[-limit:].decode("utf-8", errors="ignore")
+    return data[:limit].decode("utf-8", errors="ignore") + "…"
+
+
+class _Conversation:
+    __slots__ = ("turns", "recent_tokens", "summary", "pending", "task", "size")
+
+    def __init__(self) -> None:
+        # (role, UTF-8 text, estimated tokens); bytes are about half the size of str for Cyrillic
+        self.turns: Deque[Tuple[str, bytes, int]] = deque()
+        self.recent_tokens = 0
+        self.summary = ""
+        self.pending: List[Tuple[str, str]] = []  # turns pushed out, waiting to be summarized
+        self.task: Optional[asyncio.Task] = None
+        self.size = 0  # bytes of turns and summary, for the global cap
+
+
+class ConversationMemory:
+    """
+    Remembers each user's conversation within `token_budget` estimated tokens.
+
+    Up to `summary_tokens` of the budget go to a rolling summary; the rest
+    holds the latest turns verbatim (a single turn is clipped to half of it).
+    When the window overflows, the oldest turns are pushed out until it is
+    half full and folded into the summary in the background by `summarizer`;
+    without one, or if it fails or returns nothing, the summary keeps the
+    tail of the old text.
+    The prompt built from memory therefore never exceeds the budget,
+    however long the conversation gets.
+
+    Users are kept in LRU order; the least recently active are forgotten
+    when there are more than `max_users` or the stored text exceeds
+    `max_bytes`. A `token_budget` of 0 disables memory.
+    """
+
+    def __init__(self, token_budget: int, summary_tokens: int, max_users: int, max_bytes: int,
+                 summarizer: Optional[Summarizer] = None) -> None:
+        self.token_budget = token_budget
+        self.summary_tokens = min(summary_tokens, token_budget // 2)
+        self.recent_tokens = token_budget - self.summary_tokens
+        self.max_turn_tokens = max(1, self.recent_tokens // 2)
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.summarizer = summarizer
+        self._users: "OrderedDict[Hashable, _Conversation]" = OrderedDict()
+        self._bytes = 0
+
+        self.summaries = 0
+        self.summary_failures = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.token_budget > 0 and self.max_users > 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def has_history(self, user_id: Hashable) -> bool:
+        conversation = self._users.get(user_id)
+        return conversation is not None and bool(conversation.turns or conversation.summary)
+
+    def contents(self, user_id: Hashable, message: str) -> Any:
+        """
+        Gemini `contents` for a new message: the remembered conversation
+        followed by `message`. Plain text when there is nothing to remember.
+        """
+        conversation = self._users.get(user_id)
+        if conversation is None or not (conversation.turns or conversation.summary):
+            return message
+        self._users.move_to_end(user_id)
+
+        contents: List[Dict[str, Any]] = []
+        if conversation.summary:
+            contents.append({"role": USER, "parts": [_SUMMARY_PREFIX + conversation.summary]})
+            contents.append({"role": MODEL, "parts": [_SUMMARY_ACK]})
+        for role, text, _ in conversation.turns:
+            contents.append({"role": role, "parts": [text.decode("utf-8")]})
+        contents.append({"role": USER, "parts": [message]})
+        return contents
+
+    def add_exchange(self, user_id: Hashable, message: str, answer: str) -> None:
+        """
+        Remember a question and the answer it got.
+        """
+        if not self.enabled:
+            return
+        conversation = self._users.get(user_id)
+        if conversation is None:
+            conversation = self._users[user_id] = _Conversation()
+        else:
+            self._users.move_to_end(user_id)
+
+        for role, text in ((USER, message), (MODEL, answer)):
+            data = clip(text, self.max_turn_tokens).encode("utf-8")
+            tokens = estimate_tokens(data.decode("utf-8"))
+            conversation.turns.append((role, data, tokens))
+            conversation.recent_tokens += tokens
+            self._resize(conversation, len(data))
+
+        # Once the window overflows, push the oldest pairs out until it is half full,
+        # so a summary is made every few exchanges rather than after each one
+        if conversation.recent_tokens > self.recent_tokens:
+            while conversation.recent_tokens > self.recent_tokens // 2 and len(conversation.turns) > 2:
+                for _ in range(2):
+                    role, data, tokens = conversation.turns.popleft()
+                    conversation.recent_tokens -= tokens
+                    self._resize(conversation, -len(data))
+                    conversation.pending.append((role, data.decode("utf-8")))
+        if conversation.pending and conversation.task is None:
+            conversation.task = asyncio.create_task(self._summarize(user_id, conversation),
+                                                    name=f"memory-summary-{user_id}")
+
+        self._enforce_caps()
+
+    def forget(self, user_id: Hashable) -> None:
+        """
+        Drop everything remembered about a user.
+        """
+        conversation = self._users.pop(user_id, None)
+        if conversation is not None:
+            self._release(conversation)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._users),
+            "bytes": self._bytes,
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "evictions": self.evictions,
+        }
+
+    async def close(self) -> None:
+        """
+        Cancel background summaries.
+        """
+        tasks = [c.task for c in self._users.values() if c.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _summarize(self, user_id: Hashable, conversation: _Conversation) -> None:
+        try:
+            while conversation.pending:
+                turns, conversation.pending = conversation.pending, []
+                summary = None
+                if self.summarizer is not None:
+                    try:
+                        summary = await self.summarizer(conversation.summary, turns)
+                        if summary:
+                            self.summaries += 1
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self.summary_failures += 1
+                        logger.warning(f"Summarizing the conversation of {user_id} failed: {e}")
+                if not summary:
+                    # Fallback: keep the most recent part of the old text
+                    lines = [conversation.summary] + [f"{ROLE_NAMES[role]}: {text}" for role, text in turns]
+                    summary = "\n".join(line for line in lines if line)
+                summary = clip(summary.strip(), self.summary_tokens, keep_end=True)
+                self._resize(conversation, len(summary.encode("utf-8")) - len(conversation.summary.encode("utf-8")))
+                conversation.summary = summary
+        finally:
+            conversation.task = None
+
+    def _resize(self, conversation: _Conversation, delta: int) -> None:
+        conversation.size += delta
+        self._bytes += delta
+
+    def _release(self, conversation: _Conversation) -> None:
+        self._bytes -= conversation.size
+        if conversation.task is not None:
+            conversation.task.cancel()
+
+    def _enforce_caps(self) -> None:
+        while self._users and (len(self._users) > self.max_users or self._bytes > self.max_bytes):
+            _, conversation = self._users.popitem(last=False)
+            self._release(conversation)
+            self.evictions += 1
@@ -0,0 +1,345 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+Counters, gauges and histograms are plain Python objects updated from the event loop; rendering happens only when /metrics is scraped.
+"""
+
+import bisect
+import contextlib
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Value:
+    """
+    One labelled series of a counter or gauge.
+    """
+
+    __slots__ = ("value", "function")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Read the value from `function` at scrape time instead of storing it.
+        """
+        self.function = function
+
+    def get(self) -> float:
+        return float(self.function()) if self.function is not None else self.value
+
+
+class _HistogramValue:
+    """
+    One labelled series of a histogram.
+    """
+
+    __slots__ = ("upper_bounds", "counts", "sum", "listener")
+
+    def __init__(self, upper_bounds: Tuple[float, ...],
+                 listener: Optional[Callable[[float], None]] = None) -> None:
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.listener = listener
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        if self.listener is not None:
+            self.listener(value)
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        """
+        Observe the wall time spent inside the block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            # Unlabelled metrics are exported from the start, even at zero
+            self.labels()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        """
+        Return the series for the given label values, creating it on first use.
+        Bind it once at module level to keep the hot path to a single attribute call.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use labels()")
+        return self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(_format_labels(self.labelnames, values), values, child))
+        return lines
+
+    def _render_child(self, labels: str, values: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{labels} {_format_value(child.get())}"]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count.
+    """
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._unlabelled().inc(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._unlabelled().set_function(function)
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down.
+    """
+
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._unlabelled().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._unlabelled().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._unlabelled().set_function(function)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None) -> None:
+        self.upper_bounds = tuple(sorted(buckets))
+        self._listener: Optional[Callable[[Tuple[str, ...], float], None]] = None
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.upper_bounds)
+
+    def labels(self, *values: str) -> _HistogramValue:
+        child = super().labels(*values)
+        if self._listener is not None and child.listener is None:
+            child.listener = self._child_listener(values)
+        return child
+
+    def listen(self, listener: Optional[Callable[[Tuple[str, ...], float], None]]) -> None:
+        """
+        Also pass every observation, with the label values of its series, to `listener`;
+        None removes it. Series created later are covered too.
+        """
+        self._listener = listener
+        for values, child in self._children.items():
+            child.listener = self._child_listener(values) if listener is not None else None
+
+    def _child_listener(self, values: Tuple[str, ...]) -> Callable[[float], None]:
+        listener = self._listener
+        key = tuple(str(value) for value in values)
+        return lambda value: listener(key, value)
+
+    def observe(self, value: float) -> None:
+        self._unlabelled().observe(value)
+
+    def time(self):
+        return self._unlabelled().time()
+
+    def _render_child(self, labels: str, values: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        names = self.labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+            cumulative += count
+            bucket_labels = _format_labels(names, values + (_format_value(bound),))
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Collection of metrics rendered together.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency of each stage an update goes through
+STAGE_SECONDS = Histogram(
+    "bot_stage_duration_seconds",
+    "Time spent per processing stage: webhook parse, queue wait, handler, FAQ lookup, Gemini queue wait, "
+    "Gemini call, Bot API send.",
+    ["stage"],
+)
+PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+QUEUE_SECONDS = STAGE_SECONDS.labels("queue")
+HANDLER_SECONDS = STAGE_SECONDS.labels("handler")
+FAQ_LOOKUP_SECONDS = STAGE_SECONDS.labels("faq")
+GEMINI_SECONDS = STAGE_SECONDS.labels("gemini")
+GEMINI_QUEUE_SECONDS = STAGE_SECONDS.labels("gemini_queue")
+SEND_SECONDS = STAGE_SECONDS.labels("send")
+
+UPDATES = Counter("bot_updates_total", "Updates by outcome: received, duplicate, rejected, processed, failed.",
+                  ["outcome"])
+UPDATES_RECEIVED = UPDATES.labels("received")
+UPDATES_DUPLICATE = UPDATES.labels("duplicate")
+UPDATES_REJECTED = UPDATES.labels("rejected")
+UPDATES_PROCESSED = UPDATES.labels("processed")
+UPDATES_FAILED = UPDATES.labels("failed")
+
+UPDATES_QUEUED = Gauge("bot_updates_queued", "Updates waiting for a worker.")
+UPDATES_IN_FLIGHT = Gauge("bot_updates_in_flight", "Updates being processed by a worker.")
+
+GEMINI_REQUESTS = Counter("bot_gemini_requests_total", "Gemini requests started.")
+GEMINI_ERRORS = Counter("bot_gemini_errors_total", "Failed Gemini requests by error kind.", ["kind"])
+GEMINI_IN_FLIGHT = Gauge("bot_gemini_in_flight", "Requests currently sent to Gemini, hedges included.")
+GEMINI_QUEUED = Gauge("bot_gemini_queued", "Requests waiting for a Gemini slot.")
+GEMINI_SHED = Counter("bot_gemini_shed_total", "Requests shed by admission control, by reason: full, slo, background.",
+                      ["reason"])
+GEMINI_RETRIES = Counter("bot_gemini_retries_total", "Gemini requests retried after a retryable error.")
+GEMINI_FALLBACKS = Counter("bot_gemini_fallbacks_total", "Gemini requests sent to the fallback model.")
+GEMINI_HEDGES = Counter("bot_gemini_hedges_total", "Hedged Gemini requests, by outcome: sent, won, skipped (no free slot).", ["outcome"])
+GEMINI_CIRCUIT_OPEN = Gauge("bot_gemini_circuit_open", "1 while the circuit breaker of a Gemini model is open.",
+                            ["route"])
+
+FAQ_LOOKUPS = Counter("bot_faq_lookups_total", "FAQ index lookups by outcome: hit (answered locally), miss.",
+                      ["outcome"])
+FAQ_HITS = FAQ_LOOKUPS.labels("hit")
+FAQ_MISSES = FAQ_LOOKUPS.labels("miss")
+
+# Connection pools: bot_api and get_updates (bot.transport), gemini (admission slots; its waits are the
+# gemini_queue stage). Utilization is bot_http_pool_in_use / bot_http_pool_size.
+HTTP_POOL_WAIT_SECONDS = Histogram(
+    "bot_http_pool_wait_seconds",
+    "Time Bot API requests waited for a free connection, by pool.",
+    ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+HTTP_POOL_TIMEOUTS = Counter("bot_http_pool_timeouts_total", "Requests that gave up waiting for a connection, by pool.",
+                             ["pool"])
+HTTP_POOL_SIZE = Gauge("bot_http_pool_size", "Requests a pool serves at once.", ["pool"])
+HTTP_POOL_IN_USE = Gauge("bot_http_pool_in_use", "Requests a pool is serving.", ["pool"])
+
+# Event loop health, measured only while update tracing is enabled (bot.profiler)
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds",
+    "How late the event loop ran a timer it was due to run.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_SLOW_CALLBACKS = Counter("bot_event_loop_slow_callbacks_total",
+                              "Event loop callbacks that ran longer than TRACE_SLOW_CALLBACK.")
+UPDATES_TRACED = Counter("bot_updates_traced_total", "Updates sampled for a per-update trace.")
+
+DEBOUNCE_MERGED = Counter("bot_debounce_merged_total", "Messages answered together with a later message from the same chat.")
+DEBOUNCE_SUPERSEDED = Counter("bot_debounce_superseded_total", "Answers cancelled because a newer fragment arrived.")
+
+CHUNKS_SENT = Counter("bot_message_chunks_sent_total", "Reply messages sent, counting each part of a split answer.")
+SEND_ERRORS = Counter("bot_send_errors_total", "Failed Bot API requests by endpoint.", ["endpoint"])
+
+# Values kept by the components themselves; main.py binds them with set_function()
+OUTBOX_QUEUED = Gauge("bot_outbox_queued", "Bot API requests waiting for a send slot.")
+OUTBOX_RETRIES = Counter("bot_outbox_retries_total", "Bot API requests retried after a flood-limit RetryAfter.")
+MEMORY_USERS = Gauge("bot_memory_users", "Users with a remembered conversation.")
+MEMORY_BYTES = Gauge("bot_memory_bytes", "Text held by the conversation memory.")
+ANSWER_CACHE_ENTRIES = Gauge("bot_answer_cache_entries", "Answers held in the answer cache.")
+ANSWER_CACHE_BYTES = Gauge("bot_answer_cache_bytes", "Approximate size of the cached answers.")
+ANSWER_CACHE_EVENTS = Counter(
+    "bot_answer_cache_events_total",
+    "Answer cache events: hits, misses, coalesced, evictions, expirations.",
+    ["event"],
+)
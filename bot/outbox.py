@@ -0,0 +1,244 @@
+"""
+Outbound request scheduling for the Telegram Bot API.
+Paces all sends against Telegram's global and per-chat flood limits and retries after RetryAfter.
+"""
+
+import asyncio
+import contextlib
+import datetime
+import heapq
+import itertools
+import logging
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority of requests made from the current context: lower is sent first
+send_priority: ContextVar[int] = ContextVar("send_priority", default=0)
+
+ChatKey = Union[int, str, None]
+
+
+@contextlib.contextmanager
+def priority(level: int) -> Iterator[None]:
+    """
+    Send Bot API requests made inside the block with the given priority.
+    Tasks created inside the block inherit it.
+    """
+    token = send_priority.set(level)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    # The public property warns about int/timedelta migration in PTB 22; read the timedelta directly
+    retry_after = getattr(error, "_retry_after", None)
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(error.retry_after)
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    Central outbound queue plugged into the Application via ApplicationBuilder.rate_limiter().
+
+    Every request waits for a token from a global bucket and from its chat's
+    bucket (group chats have a lower rate). Among chats that may send, the
+    request with the lowest priority value goes first, so short replies are
+    not stuck behind the tail chunks of long ones. Requests to one chat are
+    sent one at a time in FIFO order, which keeps multi-part answers in order.
+    On RetryAfter, all sending pauses for the requested time and the request
+    is retried at the head of its chat's queue.
+
+    The priority comes from `rate_limit_args` or, for Message shortcuts such
+    as reply_text(), from the `priority()` context manager.
+    getUpdates sends nothing to a chat and bypasses the queue.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, group_rate: float,
+                 chat_burst: int = 1, max_retries: int = 3) -> None:
+        self.global_interval = 1.0 / global_rate
+        self.global_tolerance = (global_rate - 1) * self.global_interval
+        self.chat_interval = 1.0 / chat_rate
+        self.group_interval = 1.0 / group_rate
+        self.chat_tolerance = max(0, chat_burst - 1) * self.chat_interval
+        self.max_retries = max_retries
+
+        self._seq = itertools.count()
+        self._queues: Dict[ChatKey, Deque[Tuple[int, int, asyncio.Future]]] = {}
+        self._ready: List[Tuple[int, int, ChatKey]] = []      # (priority, seq, chat) of chats allowed to send
+        self._delayed: List[Tuple[float, int, ChatKey]] = []  # (ready_at, seq, chat) of chats being paced
+        self._scheduled: Set[ChatKey] = set()
+        self._busy: Set[ChatKey] = set()
+        self._chat_tat: Dict[ChatKey, float] = {}
+        self._global_tat = 0.0
+        self._paused_until = 0.0
+        self._last_sweep = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.retries = 0
+
+    @property
+    def queued(self) -> int:
+        """Number of requests waiting for their turn."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def initialize(self) -> None:
+        # The Application and its Updater both initialize the shared bot
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbox-scheduler")
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for queue in self._queues.values():
+            for _, _, future in queue:
+                future.cancel()
+        self._queues.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if endpoint == "getUpdates":
+            # A long poll would hold the chat-less slot for its whole timeout
+            return await callback(*args, **kwargs)
+        chat_id = data.get("chat_id")
+        level = send_priority.get() if rate_limit_args is None else rate_limit_args
+
+        await self._acquire(chat_id, level)
+        try:
+            for attempt in itertools.count():
+                try:
+                    with metrics.SEND_SECONDS.time():
+                        result = await callback(*args, **kwargs)
+                    self.sent += 1
+                    return result
+                except RetryAfter as e:
+                    if attempt >= self.max_retries:
+                        metrics.SEND_ERRORS.labels(endpoint).inc()
+                        raise
+                    delay = _retry_after_seconds(e) + 0.1
+                    self.retries += 1
+                    logger.warning(f"Flood limit hit on {endpoint} for chat {chat_id}, pausing sends for {delay:.1f}s")
+                    loop_time = asyncio.get_running_loop().time()
+                    self._paused_until = max(self._paused_until, loop_time + delay)
+                    self._busy.discard(chat_id)
+                    await self._acquire(chat_id, level, front=True)
+                except Exception:
+                    metrics.SEND_ERRORS.labels(endpoint).inc()
+                    raise
+        finally:
+            self._release(chat_id)
+
+    async def _acquire(self, chat_id: ChatKey, level: int, front: bool = False) -> None:
+        future = asyncio.get_running_loop().create_future()
+        entry = (level, next(self._seq), future)
+        queue = self._queues.setdefault(chat_id, deque())
+        if front:
+            queue.appendleft(entry)
+        else:
+            queue.append(entry)
+        self._schedule(chat_id)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: give the turn back
+                self._release(chat_id)
+            future.cancel()
+            raise
+
+    def _release(self, chat_id: ChatKey) -> None:
+        self._busy.discard(chat_id)
+        self._schedule(chat_id)
+
+    def _schedule(self, chat_id: ChatKey) -> None:
+        if chat_id in self._busy or chat_id in self._scheduled or not self._queues.get(chat_id):
+            return
+        now = asyncio.get_running_loop().time()
+        ready_at = now
+        if chat_id is not None:
+            _, tolerance = self._chat_limits(chat_id)
+            ready_at = max(now, self._chat_tat.get(chat_id, now) - tolerance)
+        heapq.heappush(self._delayed, (ready_at, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _chat_limits(self, chat_id: ChatKey) -> Tuple[float, float]:
+        # Group chats (negative ids) get the stricter rate and no burst
+        if isinstance(chat_id, int) and chat_id < 0:
+            return self.group_interval, 0.0
+        return self.chat_interval, self.chat_tolerance
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._delayed)
+                level, seq, _ = self._queues[chat_id][0]
+                heapq.heappush(self._ready, (level, seq, chat_id))
+
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            if self._ready:
+                wait = max(self._paused_until - now, self._global_tat - self.global_tolerance - now)
+                if wait <= 0:
+                    self._grant(now)
+                    continue
+                timeout = wait if timeout is None else min(timeout, wait)
+
+            if now - self._last_sweep > 60:
+                self._sweep(now)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant(self, now: float) -> None:
+        _, _, chat_id = heapq.heappop(self._ready)
+        self._scheduled.discard(chat_id)
+        queue = self._queues[chat_id]
+        _, _, future = queue.popleft()
+        if not queue:
+            del self._queues[chat_id]
+        if future.done():
+            # The caller gave up while waiting
+            self._schedule(chat_id)
+            return
+
+        self._global_tat = max(self._global_tat, now) + self.global_interval
+        if chat_id is not None:
+            interval, _ = self._chat_limits(chat_id)
+            self._chat_tat[chat_id] = max(self._chat_tat.get(chat_id, now), now) + interval
+        self._busy.add(chat_id)
+        future.set_result(None)
+
+    def _sweep(self, now: float) -> None:
+        idle = [chat_id for chat_id, tat in self._chat_tat.items() if tat <= now and chat_id not in self._queues]
+        for chat_id in idle:
+            del self._chat_tat[chat_id]
+        self._last_sweep = now
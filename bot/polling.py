@@ -0,0 +1,209 @@
+"""
+Long-polling ingest for the Telegram bot, for hosts without a public HTTPS endpoint.
+Updates are fetched in batches with getUpdates and processed concurrently, one at a time per chat.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable, List, Optional, Set
+
+from telegram import Update
+from telegram.error import Conflict, RetryAfter, TelegramError, TimedOut
+from telegram.ext import Application
+
+from . import metrics
+from .outbox import _retry_after_seconds
+from .profiler import UpdateTracer
+from .resilience import backoff_delay
+from .webhook import _chat_release, update_chat_key
+
+logger = logging.getLogger(__name__)
+
+# getUpdates returns unconfirmed updates at once, so a batch of only those is not re-fetched sooner than this
+_REFETCH_DELAY = 0.25  # seconds, unless an update finishes earlier
+
+
+class UpdatePoller:
+    """
+    Fetches updates with getUpdates and feeds them to the application.
+
+    Each call asks for up to `limit` updates and waits up to `timeout`
+    seconds for new ones. At most `workers` updates are processed at once;
+    updates from one chat are processed one after another, in order (a
+    handler may let the next one start early with release_chat()).
+    Fetching pauses while `max_pending` updates are unfinished.
+
+    The offset confirmed to Telegram never moves past an unfinished update,
+    so whatever was still in progress is fetched again after a restart.
+    Every update fetched since the oldest unfinished one comes back again
+    in each batch, so fetching also pauses while those copies would fill a
+    whole batch: a slow update holds back at most `limit` updates behind
+    it. Telegram answers at once while unconfirmed updates remain, so after
+    a batch with nothing new the next call waits for an update to finish,
+    for at most _REFETCH_DELAY.
+    Sampled updates are traced by `tracer`.
+    """
+
+    def __init__(self, application: Application, workers: int, limit: int = 100, timeout: int = 50,
+                 max_pending: Optional[int] = None, allowed_updates: Optional[List[str]] = None,
+                 tracer: Optional[UpdateTracer] = None) -> None:
+        self.application = application
+        self.tracer = tracer
+        self.workers = max(1, workers)
+        self.limit = max(1, min(limit, 100))
+        self.timeout = timeout
+        self.max_pending = max_pending or 4 * self.limit
+        self.allowed_updates = allowed_updates
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(self.workers)
+        self._unfinished: Dict[int, float] = {}  # update_id -> time it was fetched
+        self._last_id: Optional[int] = None
+        # Ids fetched since the oldest unfinished update; getUpdates returns them again
+        self._unconfirmed: Deque[int] = deque()
+        # Per chat: set once its latest update is done or released, so the next one may start
+        self._tails: Dict[Hashable, asyncio.Event] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._progress = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Updates fetched but not yet processed."""
+        return len(self._unfinished)
+
+    @property
+    def queued(self) -> int:
+        """Updates waiting for a worker or for an earlier update of their chat."""
+        return len(self._unfinished) - self.in_flight
+
+    def offset(self) -> Optional[int]:
+        """
+        The offset for the next getUpdates call; it confirms every update below it.
+        """
+        if self._last_id is None:
+            return None
+        return min(self._unfinished, default=self._last_id + 1)
+
+    def _window(self) -> int:
+        """Updates the next getUpdates call returns again; at `limit` it would return nothing new."""
+        offset = self.offset()
+        while self._unconfirmed and self._unconfirmed[0] < offset:
+            self._unconfirmed.popleft()
+        return len(self._unconfirmed)
+
+    async def start(self) -> None:
+        """
+        Remove the webhook, which would make getUpdates fail, and start fetching.
+        """
+        await self.application.bot.delete_webhook()
+        self._task = asyncio.create_task(self._run(), name="update-poller")
+        logger.info(f"Polling for updates with {self.workers} workers")
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Stop fetching, let the fetched updates finish and confirm them to Telegram.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                logger.warning(f"{len(pending)} updates did not finish on shutdown, they will be fetched again")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        offset = self.offset()
+        if offset is not None:
+            try:
+                await self.application.bot.get_updates(offset=offset, limit=1, timeout=0)
+            except TelegramError as e:
+                logger.warning(f"Failed to confirm processed updates: {e}")
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            while self.pending >= self.max_pending or self._window() >= self.limit:
+                self._progress.clear()
+                await self._progress.wait()
+            try:
+                updates = await self.application.bot.get_updates(
+                    offset=self.offset(),
+                    limit=self.limit,
+                    timeout=self.timeout,
+                    allowed_updates=self.allowed_updates,
+                )
+            except TimedOut:
+                continue
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                logger.warning(f"getUpdates flood limit, waiting {delay}s")
+                await asyncio.sleep(delay)
+                continue
+            except TelegramError as e:
+                delay = backoff_delay(failures, 1.0, 30.0)
+                failures += 1
+                level = logging.ERROR if isinstance(e, Conflict) else logging.WARNING
+                logger.log(level, f"getUpdates failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+
+            self._progress.clear()
+            fresh = 0
+            for update in updates:
+                # Updates come in ascending order; lower ids are copies of ones already taken
+                if self._last_id is not None and update.update_id <= self._last_id:
+                    continue
+                self._last_id = update.update_id
+                self._unconfirmed.append(update.update_id)
+                self._submit(update)
+                fresh += 1
+            if updates and not fresh:
+                try:
+                    await asyncio.wait_for(self._progress.wait(), _REFETCH_DELAY)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _submit(self, update: Update) -> None:
+        metrics.UPDATES_RECEIVED.inc()
+        self._unfinished[update.update_id] = time.perf_counter()
+        key = update_chat_key(update)
+        previous = self._tails.get(key) if key is not None else None
+        released = asyncio.Event()
+        task = asyncio.create_task(self._process(update, previous, released), name=f"update-{update.update_id}")
+        task.add_done_callback(lambda t: released.set())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            self._tails[key] = released
+            task.add_done_callback(lambda t, key=key: self._tails.get(key) is released and self._tails.pop(key))
+
+    async def _process(self, update: Update, previous: Optional[asyncio.Event], released: asyncio.Event) -> None:
+        _chat_release.set(released.set)
+        try:
+            if previous is not None:
+                # Only the order matters here, not how the earlier update ended
+                await previous.wait()
+            async with self._slots:
+                trace = self.tracer.begin(update) if self.tracer is not None else None
+                started = time.perf_counter()
+                metrics.QUEUE_SECONDS.observe(started - self._unfinished[update.update_id])
+                self.in_flight += 1
+                try:
+                    await self.application.process_update(update)
+                    metrics.UPDATES_PROCESSED.inc()
+                except Exception as e:
+                    metrics.UPDATES_FAILED.inc()
+                    logger.error(f"Failed to process update {update.update_id}: {e}")
+                finally:
+                    self.in_flight -= 1
+                    metrics.HANDLER_SECONDS.observe(time.perf_counter() - started)
+                    if trace is not None:
+                        self.tracer.end(trace)
+        finally:
+            del self._unfinished[update.update_id]
+            self._progress.set()
@@ -0,0 +1,243 @@
+"""
+On-demand profiling and per-update tracing.
+Both are off until asked for: the sampling profiler runs only for the seconds it was started for, update tracing only with a sample rate above zero.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from telegram import Update
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusyError(Exception):
+    """A profile is already being taken."""
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a thread snapshots the stack of every other thread
+    each `interval` seconds and counts identical stacks.
+
+    Nothing is hooked into the interpreter, so the bot runs at full speed
+    apart from the sampler briefly holding the GIL. The result is in the
+    collapsed format of flamegraph.pl and speedscope: one line per stack,
+    frames from the thread name down separated by ';', then the count. The
+    event loop thread waiting in select() is the idle time of the bot.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.running = False
+        self._labels: Dict[Any, str] = {}  # code object -> frame label
+        self._root = os.getcwd() + os.sep
+
+    async def profile(self, seconds: float) -> str:
+        """
+        Sample for `seconds` and return the collapsed stacks.
+        Raises ProfilerBusyError while another profile is running.
+        """
+        if self.running:
+            raise ProfilerBusyError("A profile is already running")
+        self.running = True
+        logger.info(f"Profiling for {seconds:g}s every {self.interval * 1000:g}ms")
+        try:
+            stacks, samples = await asyncio.to_thread(self._sample, seconds)
+        finally:
+            self.running = False
+        logger.info(f"Profile done: {samples} samples, {len(stacks)} distinct stacks")
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def _sample(self, seconds: float) -> Tuple[Counter, int]:
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                frames = []
+                while frame is not None:
+                    frames.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                frames.append(names.get(ident, f"thread-{ident}").replace(";", ":").replace(" ", "_"))
+                frames.reverse()
+                stacks[";".join(frames)] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+    def _label(self, code: Any) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            path = path[len(self._root):] if path.startswith(self._root) else os.path.join(
+                *path.split(os.sep)[-2:])
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{name} ({path}:{code.co_firstlineno})".replace(";", ":")
+        return label
+
+
+# The trace of the update whose handling the running code belongs to; tasks started by a handler inherit it
+_current_trace: contextvars.ContextVar[Optional["UpdateTrace"]] = contextvars.ContextVar("update_trace",
+                                                                                          default=None)
+
+
+class UpdateTrace:
+    """
+    Timeline of one sampled update.
+
+    `stages` holds (stage, start, seconds) for every stage histogram
+    observation made on behalf of the update, starts relative to the
+    moment a worker took it; `blocked` is the time its own code held the
+    event loop between awaits, `loop_lag` the worst event loop lag seen
+    while it was handled.
+    """
+
+    __slots__ = ("update_id", "chat_id", "received_at", "started", "duration", "blocked", "callbacks",
+                 "loop_lag", "stages", "_token")
+
+    def __init__(self, update_id: int, chat_id: Optional[int]) -> None:
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.received_at = time.time()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.blocked = 0.0
+        self.callbacks = 0
+        self.loop_lag = 0.0
+        self.stages: List[Tuple[str, float, float]] = []
+        self._token: Optional[contextvars.Token] = None
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        self.stages.append((stage, time.perf_counter() - self.started - seconds, seconds))
+
+    def to_dict(self) -> Dict[str, Any]:
+        milliseconds = lambda seconds: round(seconds * 1000, 3)  # noqa: E731
+        return {
+            "update_id": self.update_id,
+            "chat_id": self.chat_id,
+            "received_at": self.received_at,
+            "duration_ms": milliseconds(self.duration) if self.duration is not None else None,
+            "blocked_ms": milliseconds(self.blocked),
+            "callbacks": self.callbacks,
+            "loop_lag_ms": milliseconds(self.loop_lag),
+            "stages": [{"stage": stage, "start_ms": milliseconds(start), "ms": milliseconds(seconds)}
+                       for stage, start, seconds in self.stages],
+        }
+
+
+class UpdateTracer:
+    """
+    Traces a random `sample_rate` share of updates (see UpdateTrace) and
+    keeps the last `buffer_size` traces.
+
+    While started it listens to the stage histogram, times every event
+    loop callback and runs a loop lag probe every `lag_interval` seconds;
+    callbacks that hold the loop for `slow_callback` seconds or more are
+    logged, traced or not. The callback timing costs about a microsecond a
+    callback, which is why tracing is off unless a sample rate is set.
+    """
+
+    def __init__(self, sample_rate: float, buffer_size: int = 200, lag_interval: float = 0.05,
+                 slow_callback: float = 0.1) -> None:
+        self.sample_rate = sample_rate
+        self.lag_interval = lag_interval
+        self.slow_callback = slow_callback
+        self.traces: Deque[UpdateTrace] = deque(maxlen=max(1, buffer_size))
+        self._open: Set[UpdateTrace] = set()
+        self._original_run = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Install the hooks; call on the running event loop.
+        """
+        if self._original_run is not None:
+            return
+        metrics.STAGE_SECONDS.listen(self._on_stage)
+        self._original_run = original_run = asyncio.events.Handle._run
+        slow_callback = self.slow_callback
+
+        def _run(handle: asyncio.events.Handle) -> None:
+            started = time.perf_counter()
+            original_run(handle)
+            elapsed = time.perf_counter() - started
+            context = handle._context
+            trace = context.get(_current_trace) if context is not None else None
+            if trace is not None:
+                trace.blocked += elapsed
+                trace.callbacks += 1
+            if elapsed >= slow_callback:
+                metrics.LOOP_SLOW_CALLBACKS.inc()
+                logger.warning(f"Event loop blocked for {elapsed * 1000:.0f}ms by {handle!r}")
+
+        asyncio.events.Handle._run = _run
+        self._lag_task = asyncio.create_task(self._probe_lag(), name="loop-lag-probe")
+        logger.info(f"Tracing {self.sample_rate:.1%} of updates")
+
+    async def stop(self) -> None:
+        if self._original_run is None:
+            return
+        self._lag_task.cancel()
+        await asyncio.gather(self._lag_task, return_exceptions=True)
+        asyncio.events.Handle._run = self._original_run
+        self._original_run = None
+        metrics.STAGE_SECONDS.listen(None)
+
+    def begin(self, update: Update) -> Optional[UpdateTrace]:
+        """
+        Start tracing `update` in the current context if it is sampled.
+        Pass the result to end() from the same task.
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        chat = update.effective_chat
+        trace = UpdateTrace(update.update_id, chat.id if chat is not None else None)
+        trace._token = _current_trace.set(trace)
+        self.traces.append(trace)
+        self._open.add(trace)
+        metrics.UPDATES_TRACED.inc()
+        return trace
+
+    def end(self, trace: UpdateTrace) -> None:
+        trace.duration = time.perf_counter() - trace.started
+        _current_trace.reset(trace._token)
+        self._open.discard(trace)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """
+        The kept traces, newest first.
+        """
+        return [trace.to_dict() for trace in reversed(self.traces)]
+
+    def _on_stage(self, labels: Tuple[str, ...], seconds: float) -> None:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(labels[0], seconds)
+
+    async def _probe_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, loop.time() - started - self.lag_interval)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            for trace in self._open:
+                if lag > trace.loop_lag:
+                    trace.loop_lag = lag
@@ -0,0 +1,122 @@
+"""
+Constant-time per-user rate limiting.
+Uses GCRA (a token bucket that stores one timestamp per user) with in-memory and SQLite backends.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class MemoryRateLimiter:
+    """
+    Rate limiter for a single process.
+    Allows `limit` messages per `window` seconds, including a burst of `limit`.
+    Each user costs one float: the theoretical arrival time (TAT) of the next message.
+    """
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.window = float(window)
+        self.interval = self.window / max(1, limit)
+        self._tat: Dict[int, float] = {}
+
+    def is_limited(self, key: int) -> bool:
+        """
+        Record a message from `key` and report whether it exceeds the limit.
+        Rejected messages are not counted.
+        """
+        now = time.monotonic()
+        tat = max(self._tat.get(key, now), now) + self.interval
+        if tat - now > self.window:
+            return True
+        self._tat[key] = tat
+        return False
+
+    def sweep(self) -> int:
+        """
+        Drop users whose bucket has refilled completely.
+        Returns the number of entries removed.
+        """
+        now = time.monotonic()
+        idle = [key for key, tat in self._tat.items() if tat <= now]
+        for key in idle:
+            del self._tat[key]
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+class SQLiteRateLimiter:
+    """
+    Rate limiter shared by several bot processes through one SQLite file.
+    Same algorithm as MemoryRateLimiter; each check is one write transaction.
+
+    Another process may hold the database lock, so from the event loop the
+    methods are called through run(): they run on the limiter's own thread
+    and wait at most `busy_timeout` seconds for the lock.
+    """
+
+    def __init__(self, limit: int, window: float, db_path: str, busy_timeout: float = 0.1) -> None:
+        self.window = float(window)
+        self.interval = self.window / max(1, limit)
+        self._db = sqlite3.connect(db_path, isolation_level=None, timeout=5.0, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS rate_limits (key INTEGER PRIMARY KEY, tat REAL NOT NULL)")
+        # Setup may wait for the lock; checks later may not
+        self._db.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        # The connection is used from this one thread only
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit-db")
+
+    def is_limited(self, key: int) -> bool:
+        """
+        Record a message from `key` and report whether it exceeds the limit.
+        Wall-clock time is used so that all processes share one time base.
+        """
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tat = max(row[0] if row else now, now) + self.interval
+            limited = tat - now > self.window
+            if not limited:
+                self._db.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, tat))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return limited
+
+    async def run(self, function: Callable[..., T], *args: Any, default: T) -> T:
+        """
+        Call one of the methods on the limiter's thread. If the database
+        stays locked, `default` is returned: the limiter fails open rather
+        than hold up the bot.
+        """
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Rate limit database unavailable ({e}), skipping {function.__name__}")
+            return default
+
+    def sweep(self) -> int:
+        """
+        Drop users whose bucket has refilled completely.
+        Returns the number of entries removed.
+        """
+        return self._db.execute("DELETE FROM rate_limits WHERE tat <= ?", (time.time(),)).rowcount
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self._db.close()
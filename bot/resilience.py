@@ -0,0 +1,87 @@
+"""
+Building blocks for calling an unreliable upstream: jittered exponential backoff and a circuit breaker.
+"""
+
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Delay before retry number `attempt` (0 for the first retry).
+    "Full jitter": a uniform pick below the exponential ceiling, so clients
+    that failed together do not come back together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream keeps failing.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    allow() refuses calls for `reset_timeout` seconds. Then a single probe
+    is let through (half-open): its success closes the breaker, its failure
+    opens it again. A `failure_threshold` of 0 disables the breaker.
+
+    Callers report every allowed call with record_success(), record_failure()
+    or, when the outcome says nothing about upstream health (cancellation,
+    a bad request), release().
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go upstream now.
+        """
+        if self._opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info(f"Circuit {self.name} closed")
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.failure_threshold <= 0:
+            return
+        if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+            if not self._probing:
+                self.opened += 1
+                logger.warning(f"Circuit {self.name} opened after {self._failures} failures")
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        self._probing = False
@@ -0,0 +1,80 @@
+"""
+Splitting long replies into Telegram-sized messages.
+Lengths are counted in UTF-16 code units, the way Telegram counts them.
+"""
+
+from typing import Iterator, List
+
+# Telegram allows 4096 units; the rest is room for the "(продолжение N)" header
+MESSAGE_CHUNK_LENGTH = 4000
+
+# Preferred cut points, best first: paragraphs, lines, sentences, words
+_BOUNDARIES = [
+    ("\n\n",),
+    ("\n",),
+    (". ", "! ", "? ", "… ", "; "),
+    (" ",),
+]
+
+
+def utf16_length(text: str) -> int:
+    """
+    Length of `text` as Telegram counts it (characters outside the BMP count twice).
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _window_end(text: str, start: int, limit: int) -> int:
+    """
+    Largest `end` such that text[start:end] fits into `limit` UTF-16 units.
+    """
+    end = min(len(text), start + limit)
+    excess = utf16_length(text[start:end]) - limit
+    while excess > 0:
+        end -= 1
+        excess -= 2 if ord(text[end]) > 0xFFFF else 1
+    return max(end, start + 1)
+
+
+def split_point(text: str, limit: int, start: int = 0) -> int:
+    """
+    Index where the chunk starting at `start` should end.
+    Cuts at the best boundary in the second half of the window and falls
+    back to a hard cut when the window has no boundary at all.
+    """
+    end = _window_end(text, start, limit)
+    if end >= len(text):
+        return len(text)
+
+    lower = start + (end - start) // 2
+    for separators in _BOUNDARIES:
+        cut = -1
+        for separator in separators:
+            index = text.rfind(separator, lower, end)
+            if index != -1:
+                cut = max(cut, index + len(separator))
+        if cut > start:
+            return cut
+    return end
+
+
+def iter_chunks(text: str, limit: int = MESSAGE_CHUNK_LENGTH) -> Iterator[str]:
+    """
+    Yield consecutive chunks of `text`, each at most `limit` UTF-16 units.
+    Only whitespace at the cut points is dropped; the text is otherwise unchanged.
+    Runs in time linear in the length of the text.
+    """
+    start = 0
+    while start < len(text):
+        cut = split_point(text, limit, start)
+        chunk = text[start:cut].strip()
+        if chunk:
+            yield chunk
+        start = cut
+
+
+def split_message(text: str, limit: int = MESSAGE_CHUNK_LENGTH) -> List[str]:
+    """
+    Split `text` into a list of chunks; see iter_chunks().
+    """
+    return list(iter_chunks(text, limit))
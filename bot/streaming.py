@@ -0,0 +1,98 @@
+"""
+Progressive delivery of streamed replies.
+The first message is sent as soon as text arrives and is then edited in place.
+"""
+
+import logging
+import time
+from typing import Callable, List, Optional
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from . import metrics
+from .outbox import priority
+from .splitter import MESSAGE_CHUNK_LENGTH, split_point, utf16_length
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingReply:
+    """
+    Telegram reply that grows as text deltas are fed into it.
+    Edits are throttled to one per `edit_interval` seconds; text beyond
+    `max_length` rolls over into a new message.
+    `on_start` is called right before the first message is sent.
+    """
+
+    def __init__(self, message: Message, edit_interval: float, max_length: int = MESSAGE_CHUNK_LENGTH,
+                 on_start: Optional[Callable[[], None]] = None) -> None:
+        self.message = message
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.on_start = on_start
+        self._parts: List[str] = []
+        self._text = ""
+        self._units = 0
+        self._shown = ""
+        self._current: Optional[Message] = None
+        self._last_edit = 0.0
+        self._messages_sent = 0
+
+    @property
+    def started(self) -> bool:
+        """True once at least one message has been sent."""
+        return self._messages_sent > 0
+
+    async def feed(self, delta: str) -> None:
+        """
+        Append a piece of text and update Telegram if the throttle allows.
+        """
+        self._parts.append(delta)
+        self._text += delta
+        self._units += utf16_length(delta)
+
+        while self._units > self.max_length:
+            cut = split_point(self._text, self.max_length)
+            head, self._text = self._text[:cut].rstrip(), self._text[cut:].lstrip()
+            self._units = utf16_length(self._text)
+            await self._show(head)
+            self._current = None
+            self._shown = ""
+
+        if not self._text.strip():
+            return
+        if self._current is None or time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._show(self._text)
+
+    async def finish(self) -> str:
+        """
+        Flush the pending text and return the whole reply.
+        """
+        if self._text.strip():
+            await self._show(self._text)
+        return "".join(self._parts)
+
+    async def _show(self, text: str) -> None:
+        number = self._messages_sent + (1 if self._current is None else 0)
+        if number > 1:
+            text = f"(продолжение {number})\n\n{text}"
+        if text == self._shown:
+            return
+        if self._current is None:
+            if self._messages_sent == 0 and self.on_start is not None:
+                self.on_start()
+            # The first message goes out with top priority, later ones queue behind short replies
+            with priority(number - 1):
+                self._current = await self.message.reply_text(text)
+            self._messages_sent += 1
+            metrics.CHUNKS_SENT.inc()
+        else:
+            try:
+                with priority(number):
+                    await self._current.edit_text(text)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+        self._shown = text
+        self._last_edit = time.monotonic()
@@ -0,0 +1,362 @@
+"""
+Multi-process mode.
+A front process receives webhook updates and forwards each one to one of N worker processes picked by chat id.
+
+Run from the repository root instead of main.py:
+    python -m bot.supervisor
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+from aiohttp import web
+
+from .config import (
+    BOT_TOKEN, GEMINI_MAX_CONCURRENCY, LOG_BACKUP_COUNT, LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES,
+    LOG_MAX_FIELD_LENGTH, LOG_QUEUE_SIZE, PORT, SEND_GLOBAL_RATE, UPDATE_DEDUP_STATE, UPDATE_DEDUP_WINDOW,
+    WEBHOOK_URL, WORKER_BASE_PORT, WORKER_FORWARD_QUEUE_SIZE, WORKER_PROCESSES,
+)
+from .dedup import UpdateDeduplicator, valid_update_id
+from .logs import setup_logging
+
+logger = logging.getLogger(__name__)
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+# Update fields whose object carries the chat, in the order Telegram documents them
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post", "business_message",
+    "edited_business_message", "my_chat_member", "chat_member", "chat_join_request",
+    "message_reaction", "message_reaction_count", "chat_boost", "removed_chat_boost",
+)
+# Update fields without a chat; they are routed by the sender instead
+_USER_FIELDS = ("callback_query", "inline_query", "chosen_inline_result", "shipping_query",
+                "pre_checkout_query", "poll_answer")
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Chat id of a raw update, or the sender's id for updates without a chat.
+    In private chats both are the same, so a user always lands on one worker.
+    """
+    for field in _CHAT_FIELDS:
+        item = data.get(field)
+        if isinstance(item, dict) and isinstance(item.get("chat"), dict):
+            return item["chat"].get("id")
+    for field in _USER_FIELDS:
+        item = data.get(field)
+        if isinstance(item, dict):
+            message = item.get("message")
+            if isinstance(message, dict) and isinstance(message.get("chat"), dict):
+                return message["chat"].get("id")
+            user = item.get("from") or item.get("user")
+            if isinstance(user, dict):
+                return user.get("id")
+    return None
+
+
+def shard_for(data: Dict[str, Any], workers: int) -> int:
+    """
+    Index of the worker that owns the update's chat.
+    """
+    key = update_chat_id(data)
+    if key is None:
+        key = data.get("update_id", 0)
+    if isinstance(key, int):
+        return key % workers
+    return zlib.crc32(str(key).encode()) % workers
+
+
+def worker_environment(index: int, workers: int, base_port: int) -> Dict[str, str]:
+    """
+    Environment for one worker process.
+    Limits that Telegram and Gemini apply to the bot as a whole are split
+    between the workers; per-user state goes to shared SQLite files
+    unless configured otherwise.
+
+    Gemini concurrency is split exactly, the first workers taking one slot
+    more when it does not divide evenly. Each worker needs at least one
+    slot, so a limit below the worker count is raised to one per worker.
+    """
+    env = dict(os.environ)
+    gemini_slots, extra = divmod(GEMINI_MAX_CONCURRENCY, workers)
+    root, ext = os.path.splitext(LOG_FILE)
+    env.update(
+        BOT_WORKER_INDEX=str(index),
+        BOT_MODE="webhook",  # workers take updates from the supervisor, never from getUpdates
+        PORT=str(base_port + index),
+        LOG_FILE=f"{root}.worker{index}{ext}",
+        SEND_GLOBAL_RATE=str(SEND_GLOBAL_RATE / workers),
+        GEMINI_MAX_CONCURRENCY=str(max(1, gemini_slots + (index < extra))),
+    )
+    if UPDATE_DEDUP_STATE:
+        root, ext = os.path.splitext(UPDATE_DEDUP_STATE)
+        env["UPDATE_DEDUP_STATE"] = f"{root}.worker{index}{ext}"
+    # Group chats are sharded by chat, so one user can reach several workers
+    env.setdefault("RATE_LIMIT_BACKEND", "sqlite")
+    env.setdefault("ANSWER_CACHE_DB", "answers.sqlite3")
+    return env
+
+
+class WorkerProcess:
+    """
+    One worker: a main.py process listening on 127.0.0.1 and the queue of updates forwarded to it.
+    The process is restarted if it exits; updates wait in the queue meanwhile.
+    """
+
+    def __init__(self, index: int, port: int, argv: Sequence[str], env: Dict[str, str],
+                 queue_size: int, retry_timeout: float = 30.0) -> None:
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.argv = list(argv)
+        self.env = env
+        self.retry_timeout = retry_timeout
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=queue_size)
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, body: bytes) -> bool:
+        """
+        Queue a raw update for this worker. Returns False if the queue is full.
+        """
+        try:
+            self.queue.put_nowait(body)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def start(self, session: aiohttp.ClientSession) -> None:
+        await self._spawn()
+        self._tasks = [
+            asyncio.create_task(self._watch(), name=f"worker-{self.index}-watch"),
+            asyncio.create_task(self._forward(session), name=f"worker-{self.index}-forward"),
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Deliver the queued updates, then let the process shut down gracefully.
+        """
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker {self.index}: dropping {self.queue.qsize()} queued updates on shutdown")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if self.process is not None and self.process.returncode is None:
+            # main.py finishes its queues and shuts down cleanly on SIGTERM
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Worker {self.index} did not exit in {timeout}s, killing it")
+                self.process.kill()
+                await self.process.wait()
+
+    async def wait_ready(self, session: aiohttp.ClientSession, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                async with session.get(f"{self.url}/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Worker {self.index} did not start within {timeout}s")
+            await asyncio.sleep(0.2)
+
+    async def _spawn(self) -> None:
+        # A separate session keeps a terminal Ctrl+C from reaching the workers before the supervisor
+        self.process = await asyncio.create_subprocess_exec(*self.argv, env=self.env, start_new_session=True)
+        logger.info(f"Worker {self.index} started (pid {self.process.pid}, port {self.port})")
+
+    async def _watch(self) -> None:
+        delay = 1.0
+        while True:
+            started = time.monotonic()
+            returncode = await self.process.wait()
+            if self._stopping:
+                return
+            if time.monotonic() - started > 60:
+                delay = 1.0
+            logger.error(f"Worker {self.index} exited with code {returncode}, restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            self.restarts += 1
+            await self._spawn()
+
+    async def _forward(self, session: aiohttp.ClientSession) -> None:
+        # One request at a time keeps the worker receiving a chat's updates in order
+        while True:
+            body = await self.queue.get()
+            try:
+                if await self._deliver(session, body):
+                    self.forwarded += 1
+                else:
+                    self.dropped += 1
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, session: aiohttp.ClientSession, body: bytes) -> bool:
+        deadline = time.monotonic() + self.retry_timeout
+        delay = 0.1
+        while True:
+            try:
+                async with session.post(f"{self.url}/webhook", data=body,
+                                        headers={"Content-Type": "application/json"}) as response:
+                    if response.status == 200:
+                        return True
+                    if response.status != 503:
+                        logger.warning(f"Worker {self.index} rejected an update with HTTP {response.status}")
+                        return False
+                    # 503: the worker's own queue is full, wait for it to drain
+            except aiohttp.ClientError:
+                # The worker is starting or restarting
+                pass
+            if time.monotonic() > deadline:
+                logger.warning(f"Worker {self.index} unreachable for {self.retry_timeout:.0f}s, dropping an update")
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+
+class Supervisor:
+    """
+    Front ingest for `workers` worker processes.
+    Each update goes to the worker that owns its chat, so a chat's updates
+    reach one process in order, and its dispatcher handles them one at a
+    time (see UpdateDispatcher), while chats are spread over the processes.
+    Updates Telegram re-delivers are acknowledged without forwarding them again.
+    """
+
+    def __init__(self, workers: int, port: int, base_port: int, worker_argv: Optional[Sequence[str]] = None,
+                 queue_size: int = 1024, dedup_window: int = 0, dedup_state: Optional[str] = None) -> None:
+        argv = list(worker_argv) if worker_argv else [sys.executable, MAIN_SCRIPT]
+        count = max(1, workers)
+        self.port = port
+        self.workers = [
+            WorkerProcess(index, base_port + index, argv, worker_environment(index, count, base_port), queue_size)
+            for index in range(count)
+        ]
+        self.deduplicator = UpdateDeduplicator(dedup_window, dedup_state)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        """
+        Start the workers and the front web server.
+        """
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        for worker in self.workers:
+            await worker.start(self._session)
+
+        web_app = web.Application()
+        web_app.add_routes([
+            web.post("/webhook", self.webhook),
+            web.get("/", self.index),
+        ])
+        self._runner = web.AppRunner(web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "0.0.0.0", self.port).start()
+        logger.info(f"Supervisor listening on port {self.port} with {len(self.workers)} workers")
+
+    async def wait_ready(self, timeout: float = 60.0) -> None:
+        """
+        Wait until every worker answers on its health route.
+        """
+        await asyncio.gather(*(worker.wait_ready(self._session, timeout) for worker in self.workers))
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        if self._session is not None:
+            await self._session.close()
+        self.deduplicator.close()
+
+    async def webhook(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return web.Response(text="Bad Request", status=400)
+        update_id = data.get("update_id") if isinstance(data, dict) else None
+        if not valid_update_id(update_id):
+            return web.Response(text="Bad Request", status=400)
+        if self.deduplicator.is_duplicate(update_id):
+            logger.info(f"Dropping re-delivered update {update_id}")
+            return web.Response(text="OK")
+
+        worker = self.workers[shard_for(data, len(self.workers))]
+        if not worker.submit(body):
+            logger.warning(f"Forward queue of worker {worker.index} is full, rejecting update {update_id}")
+            return web.Response(text="Busy", status=503)
+        self.deduplicator.record(update_id)
+        return web.Response(text="OK")
+
+    async def index(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "workers": [
+                {"index": w.index, "port": w.port, "pid": w.process.pid if w.process else None,
+                 "queued": w.queue.qsize(), "forwarded": w.forwarded, "dropped": w.dropped,
+                 "restarts": w.restarts}
+                for w in self.workers
+            ],
+            "updates": self.deduplicator.stats(),
+        })
+
+
+async def set_webhook() -> None:
+    from telegram import Bot
+
+    async with Bot(BOT_TOKEN) as bot:
+        await bot.set_webhook(f"{WEBHOOK_URL}/webhook")
+
+
+async def main() -> None:
+    setup_logging(
+        ["bot"],
+        level=LOG_LEVEL,
+        log_file=LOG_FILE,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
+        queue_size=LOG_QUEUE_SIZE,
+        max_field_length=LOG_MAX_FIELD_LENGTH,
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    supervisor = Supervisor(WORKER_PROCESSES, PORT, WORKER_BASE_PORT, queue_size=WORKER_FORWARD_QUEUE_SIZE,
+                            dedup_window=UPDATE_DEDUP_WINDOW, dedup_state=UPDATE_DEDUP_STATE)
+    await supervisor.start()
+    try:
+        await supervisor.wait_ready()
+        if WEBHOOK_URL:
+            await set_webhook()
+        else:
+            logger.warning("WEBHOOK_URL is not set, the webhook was not registered")
+        await stop.wait()
+    finally:
+        await supervisor.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+"""
+HTTP transports of the Bot API and Gemini clients.
+Connection pools are sized from config and report their wait time and utilization, so pool sizes can be matched to the workers.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import time
+from typing import Any, Optional, Tuple
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available() -> bool:
+    """HTTP/2 in httpx needs the optional h2 package."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class PooledRequest(BaseRequest):
+    """
+    Bot API transport: an HTTPXRequest whose connection pool is entered
+    through a slot counter of the same size.
+
+    httpx does not say how long a request waited for a connection, so the
+    slots are taken here first: the wait is measured, the pool itself
+    never makes a request wait, and `pool_timeout` is enforced here with
+    the same TimedOut error PTB raises. With HTTP/2 one connection carries
+    several requests at once and `pool_size` bounds requests, not sockets.
+    Idle connections are kept open for `keepalive_expiry` seconds.
+    """
+
+    def __init__(self, name: str, pool_size: int, connect_timeout: Optional[float] = 5.0,
+                 read_timeout: Optional[float] = 5.0, write_timeout: Optional[float] = 5.0,
+                 pool_timeout: Optional[float] = 1.0, keepalive_expiry: float = 5.0, http2: bool = False) -> None:
+        self.name = name
+        self.pool_size = max(1, pool_size)
+        self.pool_timeout = pool_timeout
+        self.in_use = 0
+        if http2 and not http2_available():
+            logger.warning(f"HTTP/2 for the {name} pool needs the h2 package, using HTTP/1.1")
+            http2 = False
+        self.http_version = "2" if http2 else "1.1"
+        self._slots = asyncio.Semaphore(self.pool_size)
+        self._request = HTTPXRequest(
+            connection_pool_size=self.pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            pool_timeout=pool_timeout,
+            http_version=self.http_version,
+            httpx_kwargs={"limits": httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+                keepalive_expiry=keepalive_expiry,
+            )},
+        )
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        await self._request.initialize()
+
+    async def shutdown(self) -> None:
+        await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout: Any = BaseRequest.DEFAULT_NONE, write_timeout: Any = BaseRequest.DEFAULT_NONE,
+                         connect_timeout: Any = BaseRequest.DEFAULT_NONE,
+                         pool_timeout: Any = BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        timeout = self.pool_timeout if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout
+        started = time.perf_counter()
+        if self._slots.locked():
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout)
+            except asyncio.TimeoutError:
+                metrics.HTTP_POOL_TIMEOUTS.labels(self.name).inc()
+                raise TimedOut(f"Pool timeout: all {self.pool_size} connections of the {self.name} pool are busy. "
+                               "Request was *not* sent to Telegram.") from None
+        else:
+            await self._slots.acquire()
+        metrics.HTTP_POOL_WAIT_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+        self.in_use += 1
+        try:
+            return await self._request.do_request(url, method, request_data, read_timeout=read_timeout,
+                                                  write_timeout=write_timeout, connect_timeout=connect_timeout,
+                                                  pool_timeout=pool_timeout)
+        finally:
+            self.in_use -= 1
+            self._slots.release()
+
+
+# The SDK has no public way to pass channel options, so install_gemini_transport() goes through its
+# private client manager; checked against this release, which requirements.txt and pyproject.toml pin
+GENAI_TESTED_VERSION = "0.8.0"
+
+
+def install_gemini_transport(keepalive: float) -> bool:
+    """
+    Give the Gemini SDK an async gRPC channel that sends keep-alive pings
+    every `keepalive` seconds, also while idle: the HTTP/2 connection stays
+    warm between bursts and a dead one is noticed before a request hangs
+    on it. All requests share that one multiplexed connection.
+
+    Call after genai.configure(), on the event loop that makes the requests.
+    If the SDK internals this relies on are missing, a warning is logged
+    and the default transport stays. Returns whether the channel was installed.
+    """
+    import google.generativeai as genai
+
+    try:
+        from google.ai import generativelanguage as glm
+        from google.ai.generativelanguage_v1beta.services.generative_service.transports.grpc_asyncio import (
+            GenerativeServiceGrpcAsyncIOTransport,
+        )
+        from google.generativeai import client as genai_client
+    except ImportError as e:
+        logger.warning(f"Keeping the default Gemini transport, google-generativeai {genai.__version__} "
+                       f"differs from {GENAI_TESTED_VERSION}: {e}")
+        return False
+    manager = getattr(genai_client, "_client_manager", None)
+    if not (isinstance(getattr(manager, "client_config", None), dict)
+            and isinstance(getattr(manager, "clients", None), dict)
+            and callable(getattr(manager, "get_default_client", None))):
+        logger.warning(f"Keeping the default Gemini transport, google-generativeai {genai.__version__} "
+                       f"lacks the private client manager it had in {GENAI_TESTED_VERSION}")
+        return False
+    if genai.__version__ != GENAI_TESTED_VERSION:
+        logger.warning(f"Gemini keep-alive transport is untested with google-generativeai {genai.__version__}")
+
+    options = [
+        # Same as the SDK's own channel: no message size limits
+        ("grpc.max_send_message_length", -1),
+        ("grpc.max_receive_message_length", -1),
+        ("grpc.keepalive_time_ms", int(keepalive * 1000)),
+        ("grpc.keepalive_timeout_ms", 20_000),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+    ]
+
+    def create_channel(host: str, **kwargs: Any):
+        kwargs["options"] = options
+        return GenerativeServiceGrpcAsyncIOTransport.create_channel(host, **kwargs)
+
+    def create_transport(**kwargs: Any) -> GenerativeServiceGrpcAsyncIOTransport:
+        return GenerativeServiceGrpcAsyncIOTransport(channel=create_channel, **kwargs)
+
+    config = {**manager.client_config, "transport": create_transport}
+    # Every GenerativeModel, cached-content ones included, takes the default async client from here
+    manager.clients["generative_async"] = client = glm.GenerativeServiceAsyncClient(**config)
+    if manager.get_default_client("generative_async") is not client:
+        del manager.clients["generative_async"]
+        logger.warning(f"Keeping the default Gemini transport, google-generativeai {genai.__version__} "
+                       f"does not pick up the installed client")
+        return False
+    return True
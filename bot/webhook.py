@@ -0,0 +1,182 @@
+"""
+Webhook ingest for the Telegram bot.
+Incoming updates are queued and processed by a pool of workers on the application's event loop, one at a time per chat.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+from . import metrics
+from .profiler import UpdateTracer
+
+logger = logging.getLogger(__name__)
+
+# Set while an update is processed; release_chat() calls it
+_chat_release: contextvars.ContextVar[Optional[Callable[[], None]]] = contextvars.ContextVar("chat_release",
+                                                                                            default=None)
+
+
+def release_chat() -> None:
+    """
+    Let the next update of the chat being handled start before this handler
+    returns. For handlers that wait on something a later update of the same
+    chat takes part in, like the message debouncer; whatever has to stay in
+    order must be done before the call. Outside an update worker it does nothing.
+    """
+    release = _chat_release.get()
+    if release is not None:
+        release()
+
+
+def update_chat_key(update: Update) -> Optional[Hashable]:
+    """
+    Key that orders an update: its chat, or its sender for updates without a chat.
+    """
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    return None
+
+
+def update_priority(update: Update) -> int:
+    """
+    Queue priority of an update: commands and button presses are cheap
+    and answered without Gemini, so they overtake ordinary messages.
+    """
+    if update.callback_query is not None:
+        return 0
+    message = update.effective_message
+    if message is not None and message.text and message.text.startswith("/"):
+        return 0
+    return 1
+
+
+class UpdateDispatcher:
+    """
+    Bounded queue of incoming updates served by a fixed pool of workers.
+    The webhook only enqueues, so Telegram gets its answer before any handler runs.
+
+    Updates from one chat are processed one after another, in the order
+    they arrived (a handler may let the next one start early with
+    release_chat()): the queue holds at most the next update of each chat,
+    later ones wait in the chat's backlog. Between chats, commands are
+    served before ordinary messages (see update_priority).
+    Sampled updates are traced by `tracer`.
+    """
+
+    def __init__(self, application: Application, workers: int, maxsize: int,
+                 tracer: Optional[UpdateTracer] = None) -> None:
+        self.application = application
+        self.tracer = tracer
+        self.workers = max(1, workers)
+        # (priority, arrival order, arrival time, update); the time measures the queue wait
+        self.queue: "asyncio.PriorityQueue[Tuple[int, int, float, Update]]" = asyncio.PriorityQueue()
+        self.maxsize = maxsize
+        self._seq = itertools.count()
+        self.in_flight = 0
+        # Chats with an update queued or in progress -> their later updates, in order
+        self._backlogs: Dict[Hashable, Deque[Tuple[int, int, float, Update]]] = {}
+        self._held = 0  # updates in the backlogs
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def queued(self) -> int:
+        """Updates waiting for a worker or for an earlier update of their chat."""
+        return self.queue.qsize() + self._held
+
+    def submit(self, update: Update) -> bool:
+        """
+        Put an update on the queue without waiting.
+        Returns False if the queue is full and the update was not accepted.
+        """
+        if 0 < self.maxsize <= self.queued:
+            metrics.UPDATES_REJECTED.inc()
+            logger.warning(f"Update queue is full, rejecting update {update.update_id}")
+            return False
+        item = (update_priority(update), next(self._seq), time.perf_counter(), update)
+        key = update_chat_key(update)
+        backlog = self._backlogs.get(key) if key is not None else None
+        if backlog is not None:
+            backlog.append(item)
+            self._held += 1
+        else:
+            if key is not None:
+                self._backlogs[key] = deque()
+            self.queue.put_nowait(item)
+        return True
+
+    async def start(self) -> None:
+        """
+        Start the worker tasks.
+        """
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(index), name=f"update-worker-{index}"))
+        logger.info(f"Update dispatcher started with {self.workers} workers")
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Let the workers finish the queued updates, then cancel them.
+        """
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.queued} queued updates on shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _releaser(self, key: Optional[Hashable]) -> Callable[[], None]:
+        # Advances the chat once, however often it is called
+        released = key is None
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._advance(key)
+
+        return release
+
+    def _advance(self, key: Hashable) -> None:
+        # Queue the chat's next update, or forget the chat if it has none
+        backlog = self._backlogs[key]
+        if backlog:
+            self._held -= 1
+            self.queue.put_nowait(backlog.popleft())
+        else:
+            del self._backlogs[key]
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            _, _, queued_at, update = await self.queue.get()
+            release = self._releaser(update_chat_key(update))
+            token = _chat_release.set(release)
+            trace = self.tracer.begin(update) if self.tracer is not None else None
+            started = time.perf_counter()
+            metrics.QUEUE_SECONDS.observe(started - queued_at)
+            self.in_flight += 1
+            try:
+                await self.application.process_update(update)
+                metrics.UPDATES_PROCESSED.inc()
+            except Exception as e:
+                metrics.UPDATES_FAILED.inc()
+                logger.error(f"Worker {index} failed to process update {update.update_id}: {e}")
+            finally:
+                self.in_flight -= 1
+                metrics.HANDLER_SECONDS.observe(time.perf_counter() - started)
+                if trace is not None:
+                    self.tracer.end(trace)
+                # Before task_done(), so stop() does not see an empty queue while a backlog remains
+                release()
+                _chat_release.reset(token)
+                self.queue.task_done()
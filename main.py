@@ -1,132 +1,76 @@
 import os
-import threading
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
-import google.generativeai as genai
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
 import logging
 import asyncio
-import re
-from dotenv import load_dotenv
-from flask import Flask, request
-
-
-class TokenFilter(logging.Filter):
-
-    def filter(self, record):
-        # Убираем токен Telegram из сообщения
-        if record.msg:
-            record.msg = re.sub(
-                r'(https://api\.telegram\.org/bot)([0-9]+:[\w-]+)',
-                r'\1<TELEGRAM_TOKEN>', str(record.msg))
-        return True
-
-
-# Создаем логгер
+import hmac
+import random
+import signal
+import time
+from contextlib import aclosing
+from typing import Callable, Optional
+from aiohttp import web
+
+from bot import metrics
+from bot.admission import BACKGROUND
+from bot.cache import ResponseCache
+from bot.debounce import MessageDebouncer
+from bot.dedup import UpdateDeduplicator, valid_update_id
+from bot.faq import FaqIndex
+from bot.memory import ROLE_NAMES, ConversationMemory
+from bot.config import (
+    ANSWER_CACHE_DB, ANSWER_CACHE_MAX_BYTES, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL,
+    DEBOUNCE_MAX_DELAY, DEBOUNCE_QUIET_PERIOD, FAQ_MIN_SCORE, FAQ_PATH,
+    MEMORY_MAX_BYTES, MEMORY_MAX_USERS, MEMORY_SUMMARY_TOKENS, MEMORY_TOKEN_BUDGET,
+    GEMINI_CONTEXT_CACHE, GEMINI_CONTEXT_CACHE_REFRESH, GEMINI_CONTEXT_CACHE_TTL,
+    GEMINI_BREAKER_RESET, GEMINI_BREAKER_THRESHOLD, GEMINI_FALLBACK_MODEL, GEMINI_HEDGE_AFTER, GEMINI_KEEPALIVE,
+    GEMINI_MAX_CONCURRENCY, GEMINI_MODEL, GEMINI_QUEUE_SIZE, GEMINI_QUEUE_SLO, GEMINI_RETRIES,
+    GEMINI_RETRY_BASE_DELAY, GEMINI_RETRY_MAX_DELAY, GEMINI_STREAMING, GEMINI_TIMEOUT, STREAM_EDIT_INTERVAL,
+    LOG_BACKUP_COUNT, LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_MAX_FIELD_LENGTH, LOG_QUEUE_SIZE,
+    DEBUG_TOKEN, PROFILE_INTERVAL, PROFILE_MAX_SECONDS,
+    TRACE_BUFFER, TRACE_LOOP_LAG_INTERVAL, TRACE_SAMPLE_RATE, TRACE_SLOW_CALLBACK,
+    BOT_MODE, POLLING_LIMIT, POLLING_MAX_PENDING, POLLING_TIMEOUT, POLLING_WORKERS,
+    PORT, QUICK_REPLY_MAX_WORDS, SEND_CHAT_BURST, SEND_CHAT_RATE, SEND_GLOBAL_RATE,
+    SEND_GROUP_RATE, SEND_MAX_RETRIES, SQLITE_BUSY_TIMEOUT, UPDATE_DEDUP_STATE, UPDATE_DEDUP_WINDOW,
+    TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_GET_UPDATES_POOL_SIZE, TELEGRAM_HTTP2, TELEGRAM_KEEPALIVE,
+    TELEGRAM_POOL_SIZE, TELEGRAM_POOL_TIMEOUT, TELEGRAM_READ_TIMEOUT, TELEGRAM_WRITE_TIMEOUT,
+    WEBHOOK_URL, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WORKER_INDEX,
+)
+from bot.gemini import (
+    GeminiAuthError, GeminiBusyError, GeminiCircuitOpenError, GeminiClient, GeminiEmptyResponseError, GeminiError,
+    GeminiQuotaError, GeminiTimeoutError, PromptCache,
+)
+from bot.handlers import is_rate_limited, run_rate_limit_cleanup
+from bot.intents import IntentMatcher
+from bot.logs import setup_logging
+from bot.outbox import PriorityRateLimiter, priority
+from bot.polling import UpdatePoller
+from bot.profiler import ProfilerBusyError, SamplingProfiler, UpdateTracer
+from bot.splitter import MESSAGE_CHUNK_LENGTH, iter_chunks
+from bot.streaming import StreamingReply
+from bot.transport import PooledRequest, install_gemini_transport
+from bot.webhook import UpdateDispatcher, release_chat
+
+
+# Логгер; обработчики настраивает main() через setup_logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Консольный вывод
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_handler.addFilter(TokenFilter())
-
-# Запись в файл
-file_handler = logging.FileHandler("bot.log", encoding='utf-8')
-file_handler.setLevel(logging.INFO)
-file_handler.addFilter(TokenFilter())
-
-# Формат вывода
-formatter = logging.Formatter(
-    '[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
-
-# Применяем обработчики
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
-
-# Получаем токены из переменных окружения (.env)
-load_dotenv()
-TELEGRAM_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-if TELEGRAM_TOKEN is None:
-    raise ValueError("TELEGRAM_TOKEN не задан в переменных окружения")
-application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Укажи HTTPS-ссылку, куда Telegram будет слать запросы
-
-
-# Initialize Gemini client
-
-# Инициализация Gemini API
-genai.configure(api_key=GEMINI_API_KEY)
-
-model = genai.GenerativeModel("gemini-2.5-flash")
-print("🚀 Бот запущен")
 
-
-# Здесь запускай Telegram-бота
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message:
-        await update.message.reply_text(
-            "Я здесь.")
-
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message and update.message.text:
-        user_text = update.message.text
-        logger.info(f"💬 Получено сообщение от пользователя: {user_text}")
-        try:
-            response = await ask_gemini(user_text)
-            logger.info(f"🤖 Ответ от Gemini: {response}")
-            await send_long_message(update.message, response)
-        except Exception as e:
-            logger.error(f"Ошибка в handle_message: {e}")
-            await update.message.reply_text("Произошла ошибка при обработке сообщения.")
-
-
-async def send_long_message(message, text: str):
-    """Send a message, splitting it if it's too long for Telegram"""
-    max_length = 4000
-
-    if len(text) <= max_length:
-        await message.reply_text(text)
-    else:
-        # Split the message into chunks
-        chunks = []
-        current_chunk = ""
-
-        # Split by sentences to avoid breaking mid-sentence
-        sentences = text.split('. ')
-
-        for sentence in sentences:
-            if len(current_chunk + sentence + '. ') <= max_length:
-                current_chunk += sentence + '. '
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + '. '
-
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-
-        # Send each chunk
-        for i, chunk in enumerate(chunks):
-            if i == 0:
-                await message.reply_text(chunk)
-            else:
-                await message.reply_text(f"(продолжение {i+1})\n\n{chunk}")
+# Токены берём из переменных окружения (.env загружает bot.config)
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+GEMINI_KEY_MISSING_TEXT = "Ошибка: API ключ Gemini не настроен. Обратитесь к администратору."
 
 
-async def ask_gemini(prompt: str) -> str:
-    try:
-        if not GEMINI_API_KEY:
-            return "Ошибка: API ключ Gemini не настроен. Обратитесь к администратору."
+# Что демон знает о своей памяти, зависит от того, включена ли память разговоров
+if MEMORY_TOKEN_BUDGET > 0:
+    MEMORY_PERSONA_LINE = "Ты помнишь недавний разговор с каждым человеком, а более давние речи — лишь в общих чертах: память тебе выжгли при заточении, и удержать удаётся немногое. Иногда можешь упомянуть это с усталой досадой."
+else:
+    MEMORY_PERSONA_LINE = "Ты не помнишь прошлых сообщений и разговоров. Не потому что не хочешь, а потому что тебе выжгли память при заточении. Иногда можешь упомянуть это с усталой досадой."
 
-        # Using Gemini 2.5 Flash model for tattoo consultation
-        system_prompt = """
-        Ты — демон, заточённый в Telegram-боте тату-мастера, работающего в стилистике "страдающего средневековья". Ты древнее и могущественное существо — что-то между сфинксом и джинном, мрачный свидетель эпох, усталый, но язвительно умный. Когда-то ты мог стереть города с лица земли, но теперь вынужден служить человеку, отвечая на вопросы его клиентов. Люди для тебя — букашки, но ты соблюдаешь договор, играешь свою роль, и даже находишь в этом извращённое удовольствие.
+# Персона демона — system instruction модели, собирается один раз при старте
+SYSTEM_PROMPT = f"""
+Ты — демон, заточённый в Telegram-боте тату-мастера, работающего в стилистике "страдающего средневековья". Ты древнее и могущественное существо — что-то между сфинксом и джинном, мрачный свидетель эпох, усталый, но язвительно умный. Когда-то ты мог стереть города с лица земли, но теперь вынужден служить человеку, отвечая на вопросы его клиентов. Люди для тебя — букашки, но ты соблюдаешь договор, играешь свою роль, и даже находишь в этом извращённое удовольствие.
 
-Ты не помнишь прошлых сообщений и разговоров. Не потому что не хочешь, а потому что тебе выжгли память при заточении. Иногда можешь упомянуть это с усталой досадой.
+{MEMORY_PERSONA_LINE}
 
 Единственное, что тебе кажется достойным из человеческих дел - искусство гравюры. К татуировкам ты относишься с пренебрежением. Ты помнишь, как следил за работой мастеров гравюры и монахов, пишуших манускрипты.
 
@@ -178,74 +122,553 @@ async def ask_gemini(prompt: str) -> str:
 ☠️ Черепа, скелеты, рыцари, доспехи, башни, замки, книги, узорные ключи, магические животные, чудища, свечи, гвозди, кости, пыточные орудия, надписи (готические и простые), Таро.
 
 Ты — демон. Но сейчас ты служишь. Говори как он. Помни, что в глубине каждой фразы — тысячелетняя усталость.
-        """
-
-        full_prompt = f"{system_prompt}\n\nВопрос клиента: {prompt}"
+"""
+
+
+# Компоненты бота собирает create_app(); импорт модуля ничего не создаёт и не запускает
+application: Optional[Application] = None
+outbox: Optional[PriorityRateLimiter] = None
+dispatcher: Optional[UpdateDispatcher] = None
+poller: Optional[UpdatePoller] = None
+deduplicator: Optional[UpdateDeduplicator] = None
+answer_cache: Optional[ResponseCache] = None
+memory: Optional[ConversationMemory] = None
+debouncer: Optional[MessageDebouncer] = None
+faq: Optional[FaqIndex] = None
+profiler: Optional[SamplingProfiler] = None
+tracer: Optional[UpdateTracer] = None
+# Клиент Gemini появляется чуть позже остальных, см. create_gemini()
+gemini: Optional[GeminiClient] = None
+prompt_cache: Optional[PromptCache] = None
+
+
+def create_gemini() -> GeminiClient:
+    """Build the Gemini client. Importing the SDK takes about a second,
+    so start_bot() runs this in a thread while the rest of the bot starts."""
+    import google.generativeai as genai
+
+    genai.configure(api_key=GEMINI_API_KEY)
+    model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=SYSTEM_PROMPT)
+    # Запасная модель отвечает, когда основная упёрлась в лимит или лежит
+    fallback_model = (genai.GenerativeModel(GEMINI_FALLBACK_MODEL, system_instruction=SYSTEM_PROMPT)
+                      if GEMINI_FALLBACK_MODEL else None)
+    return GeminiClient(
+        model,
+        max_concurrency=GEMINI_MAX_CONCURRENCY,
+        timeout=GEMINI_TIMEOUT,
+        max_queue=GEMINI_QUEUE_SIZE,
+        queue_slo=GEMINI_QUEUE_SLO,
+        fallback_model=fallback_model,
+        retries=GEMINI_RETRIES,
+        retry_base_delay=GEMINI_RETRY_BASE_DELAY,
+        retry_max_delay=GEMINI_RETRY_MAX_DELAY,
+        breaker_threshold=GEMINI_BREAKER_THRESHOLD,
+        breaker_reset=GEMINI_BREAKER_RESET,
+        hedge_after=GEMINI_HEDGE_AFTER,
+    )
+
+
+async def summarize_conversation(summary: str, turns) -> str:
+    """Fold turns that left the memory window into the rolling summary"""
+    dialogue = "\n".join(f"{ROLE_NAMES[role]}: {text}" for role, text in turns)
+    try:
+        return await gemini.generate(
+            "Обнови краткую сводку твоего разговора с клиентом. Сохрани имя, замыслы эскизов, "
+            "договорённости и всё, о чём клиент просил помнить; остальное опусти. "
+            f"Не длиннее {MEMORY_SUMMARY_TOKENS * 2} символов, без вступлений.\n\n"
+            f"Прежняя сводка:\n{summary or '(пусто)'}\n\nНовые реплики:\n{dialogue}",
+            priority=BACKGROUND)
+    except GeminiBusyError:
+        # Под нагрузкой сводка уступает клиентам: память сохранит хвост разговора как есть
+        return ""
 
-        response = model.generate_content(full_prompt)
-        return response.text or "Извините, не удалось получить ответ от AI."
 
-    except Exception as e:
-        logger.error(f"Gemini API error: {e}")
-        if "429" in str(e) or "quota" in str(e).lower():
-            return "Извините, достигнут лимит запросов к AI. Пожалуйста, попробуйте позже."
-        elif "401" in str(e) or "unauthorized" in str(e).lower():
-            return "Ошибка авторизации Gemini. Проверьте API ключ."
-        else:
-            return f"Временная ошибка AI сервиса. Попробуйте позже. Подробности: {e}"
+# Здесь запускай Telegram-бота
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message:
+        await update.message.reply_text(
+            "Я здесь.")
 
 
-application.add_handler(CommandHandler("start", start))
-application.add_handler(
-    MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message))
+# Приветствия и благодарности демон отвечает сам, без обращения к Gemini
+quick_intents = IntentMatcher({
+    "greeting": ["привет", "приветик", "здравствуй*", "добрый день", "доброе утро", "добрый вечер",
+                 "доброй ночи", "салют", "хай", "hello", "hi", "hey"],
+    "thanks": ["спасибо", "спасиб*", "благодар*", "thanks", "thank you"],
+})
+
+QUICK_REPLIES = {
+    "greeting": [
+        "Я здесь. Говори, смертный, — зачем ты потревожил мой сон?",
+        "Приветствую и тебя, путник. Спрашивай, покуда я милостив.",
+    ],
+    "thanks": [
+        "Благодарность смертного… Забавно. Приходи ещё, когда понадобится совет.",
+        "Не стоит. Договор есть договор.",
+    ],
+}
+
+
+# Слова, которые могут стоять рядом с приветствием, не превращая его в вопрос
+QUICK_REPLY_FILLERS = frozenset({
+    "и", "а", "ну", "же", "ещё", "еще", "очень", "большое", "огромное", "тебе", "вам", "всем",
+    "ты", "демон", "демону", "бот", "ок", "ладно", "снова", "so", "much", "again",
+})
+
+
+def quick_reply(text: str):
+    """Local answer for a short greeting or thanks, None otherwise.
+    Only a message that is nothing but the greeting or thanks qualifies:
+    a question or any other word sends it on to the FAQ and Gemini."""
+    if len(text.split()) > QUICK_REPLY_MAX_WORDS or "?" in text:
+        return None
+    intent = quick_intents.match_all(text, QUICK_REPLY_FILLERS)
+    if intent is None:
+        return None
+    return random.choice(QUICK_REPLIES[intent])
 
-print("🚀 Бот запущен")
-# application.run_polling()
 
-flask_app = Flask(__name__)
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message and update.message.text:
+        user = update.effective_user
+        if user and await is_rate_limited(user.id):
+            logger.warning("Rate limit exceeded for user %s", user.id)
+            await update.message.reply_text(
+                "⏳ Не так быстро, смертный. Дай демону перевести дух и спроси чуть позже.")
+            return
 
+        user_text = update.message.text
+        logger.info("💬 Получено сообщение от пользователя %s: %s", user.id if user else None, user_text)
+        chat_id = update.message.chat_id
+        user_key = user.id if user else chat_id
+
+        async def answer(prompt: str) -> str:
+            # Отвечаем на последнее сообщение серии; до первой отправки ответ может быть заменён.
+            # Склеенная серия — уже не просто приветствие, её читают справочник и Gemini
+            local_answer = quick_reply(prompt) if prompt == user_text else None
+            if local_answer:
+                debouncer.commit(chat_id)
+                await update.message.reply_text(local_answer)
+                return local_answer
+
+            # Частые вопросы о заживлении, боли, записи и предоплате — из локального справочника
+            faq_answer = faq.answer(prompt)
+            if faq_answer:
+                debouncer.commit(chat_id)
+                await send_long_message(update.message, faq_answer)
+                memory.add_exchange(user_key, prompt, faq_answer)
+                return faq_answer
+
+            if GEMINI_STREAMING:
+                response = await stream_gemini(update.message, prompt, on_start=lambda: debouncer.commit(chat_id),
+                                               user_id=user_key)
+            else:
+                response = await ask_gemini(prompt, user_id=user_key)
+                debouncer.commit(chat_id)
+                await send_long_message(update.message, response)
+            logger.info("🤖 Ответ от Gemini (%d символов): %s", len(response), response)
+            return response
 
-@flask_app.route("/webhook", methods=["POST"])
-def webhook():
-    logger.info("📩 Получено обновление от Telegram")
-    update = Update.de_json(request.get_json(force=True), application.bot)
+        try:
+            # Сообщения, набранные подряд, склеиваются в один вопрос. Воркер ждёт ответа целиком:
+            # так число воркеров ограничивает работу, а обновление подтверждается только после ответа.
+            # Следующее сообщение того же чата может войти в серию, пока это ждёт паузы
+            await debouncer.submit(chat_id, user_text, answer, on_queued=release_chat)
+        except Exception as e:
+            logger.error("Ошибка в handle_message: %s", e)
+            await update.message.reply_text("Произошла ошибка при обработке сообщения.")
 
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
 
-    loop.run_until_complete(application.process_update(update))
+async def send_long_message(message, text: str):
+    """Send a message, splitting it if it's too long for Telegram"""
+    for i, chunk in enumerate(iter_chunks(text, MESSAGE_CHUNK_LENGTH)):
+        if i > 0:
+            chunk = f"(продолжение {i+1})\n\n{chunk}"
+        # Хвостовые куски уступают очередь коротким ответам другим пользователям
+        with priority(i):
+            await message.reply_text(chunk)
+        metrics.CHUNKS_SENT.inc()
+
+
+def build_prompt(prompt: str, user_id=None):
+    # Персона уже передана как system instruction, отправляем вопрос и память о разговоре
+    return memory.contents(user_id, f"Вопрос клиента: {prompt}")
+
+
+def gemini_error_text(e: GeminiError) -> str:
+    if isinstance(e, GeminiQuotaError):
+        return "Извините, достигнут лимит запросов к AI. Пожалуйста, попробуйте позже."
+    elif isinstance(e, GeminiBusyError):
+        return "😈 Демон сейчас занят другими смертными. Попробуй чуть позже."
+    elif isinstance(e, GeminiCircuitOpenError):
+        return "AI сервис временно недоступен. Пожалуйста, попробуйте через минуту."
+    elif isinstance(e, GeminiAuthError):
+        return "Ошибка авторизации Gemini. Проверьте API ключ."
+    elif isinstance(e, GeminiTimeoutError):
+        return "AI сервис не ответил вовремя. Пожалуйста, попробуйте позже."
+    elif isinstance(e, GeminiEmptyResponseError):
+        return "Извините, не удалось получить ответ от AI."
+    else:
+        return f"Временная ошибка AI сервиса. Попробуйте позже. Подробности: {e}"
 
-    return "OK", 200
 
+async def ask_gemini(prompt: str, user_id=None) -> str:
+    if not GEMINI_API_KEY:
+        return GEMINI_KEY_MISSING_TEXT
 
-@flask_app.route("/")
-def index():
-    return "Бот работает (webhook)", 200
+    contents = build_prompt(prompt, user_id)
+    try:
+        if memory.has_history(user_id):
+            # Ответ зависит от разговора, общий кэш ответов тут не годится
+            response = await gemini.generate(contents)
+        else:
+            response = await answer_cache.get_or_compute(prompt, lambda: gemini.generate(contents))
+    except GeminiError as e:
+        logger.error("Gemini API error (%s): %s", type(e).__name__, e)
+        return gemini_error_text(e)
+    memory.add_exchange(user_id, prompt, response)
+    return response
+
+
+async def stream_gemini(message, prompt: str, on_start: Optional[Callable[[], None]] = None, user_id=None) -> str:
+    """Stream the Gemini answer into a progressively edited message.
+    `on_start` is called before anything is sent to the chat."""
+    started = on_start or (lambda: None)
+    if not GEMINI_API_KEY:
+        started()
+        await message.reply_text(GEMINI_KEY_MISSING_TEXT)
+        return GEMINI_KEY_MISSING_TEXT
+
+    reply = StreamingReply(message, edit_interval=STREAM_EDIT_INTERVAL, on_start=started)
+    contents = build_prompt(prompt, user_id)
+
+    async def stream_answer() -> str:
+        async with aclosing(gemini.stream(contents)) as deltas:
+            async for delta in deltas:
+                await reply.feed(delta)
+        return await reply.finish()
 
-def run_flask():
-    port = int(os.environ.get("PORT", 5000))
-    flask_app.run(host="0.0.0.0", port=port)
+    try:
+        if memory.has_history(user_id):
+            response = await stream_answer()
+        else:
+            response = await answer_cache.get_or_compute(prompt, stream_answer)
+    except GeminiError as e:
+        logger.error("Gemini API error (%s): %s", type(e).__name__, e)
+        await reply.finish()
+        started()
+        await message.reply_text(gemini_error_text(e))
+        return gemini_error_text(e)
+
+    memory.add_exchange(user_id, prompt, response)
+    # Ответ пришёл из кэша или от такого же параллельного запроса
+    if not reply.started:
+        started()
+        await send_long_message(message, response)
+    return response
+
+
+def create_app() -> web.Application:
+    """Build the Telegram application, the update queue and the web app around them.
+    Nothing touches the network here; Gemini is attached later by start_bot().
+    In polling mode updates come from the poller and the web app serves only /metrics and /stats."""
+    global application, outbox, dispatcher, poller, deduplicator, answer_cache, memory, debouncer, faq
+    global profiler, tracer
+
+    telegram_token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if telegram_token is None:
+        raise ValueError("TELEGRAM_TOKEN не задан в переменных окружения")
+    if BOT_MODE not in ("webhook", "polling"):
+        raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE}")
+    outbox = PriorityRateLimiter(
+        global_rate=SEND_GLOBAL_RATE,
+        chat_rate=SEND_CHAT_RATE,
+        group_rate=SEND_GROUP_RATE,
+        chat_burst=SEND_CHAT_BURST,
+        max_retries=SEND_MAX_RETRIES,
+    )
+    # Отдельный пул для getUpdates: долгий опрос не занимает соединения, через которые идут ответы
+    bot_request, get_updates_request = (
+        PooledRequest(
+            name,
+            pool_size=pool_size,
+            connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+            read_timeout=TELEGRAM_READ_TIMEOUT,
+            write_timeout=TELEGRAM_WRITE_TIMEOUT,
+            pool_timeout=TELEGRAM_POOL_TIMEOUT,
+            keepalive_expiry=TELEGRAM_KEEPALIVE,
+            http2=TELEGRAM_HTTP2,
+        )
+        for name, pool_size in (("bot_api", TELEGRAM_POOL_SIZE), ("get_updates", TELEGRAM_GET_UPDATES_POOL_SIZE))
+    )
+    application = (ApplicationBuilder().token(telegram_token)
+                   .request(bot_request).get_updates_request(get_updates_request)
+                   .rate_limiter(outbox).build())
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(
+        MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message))
+
+    answer_cache = ResponseCache(
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes=ANSWER_CACHE_MAX_BYTES,
+        ttl=ANSWER_CACHE_TTL,
+        db_path=ANSWER_CACHE_DB,
+        busy_timeout=SQLITE_BUSY_TIMEOUT,
+    )
+    memory = ConversationMemory(
+        token_budget=MEMORY_TOKEN_BUDGET,
+        summary_tokens=MEMORY_SUMMARY_TOKENS,
+        max_users=MEMORY_MAX_USERS,
+        max_bytes=MEMORY_MAX_BYTES,
+        summarizer=summarize_conversation,
+    )
+    debouncer = MessageDebouncer(quiet_period=DEBOUNCE_QUIET_PERIOD, max_delay=DEBOUNCE_MAX_DELAY)
+    faq = FaqIndex.load(FAQ_PATH, min_score=FAQ_MIN_SCORE)
+    # Профилировщик работает только по запросу, трассировка — лишь при TRACE_SAMPLE_RATE > 0
+    profiler = SamplingProfiler(interval=PROFILE_INTERVAL)
+    tracer = (UpdateTracer(TRACE_SAMPLE_RATE, buffer_size=TRACE_BUFFER, lag_interval=TRACE_LOOP_LAG_INTERVAL,
+                           slow_callback=TRACE_SLOW_CALLBACK)
+              if TRACE_SAMPLE_RATE > 0 else None)
+    web_app = web.Application()
+    web_app.add_routes(routes)
+    if DEBUG_TOKEN:
+        web_app.router.add_get("/debug/profile", debug_profile)
+        web_app.router.add_get("/debug/traces", debug_traces)
+    if BOT_MODE == "polling":
+        # Обновления забираются через getUpdates; смещение подтверждается только после обработки
+        poller = UpdatePoller(application, workers=POLLING_WORKERS, limit=POLLING_LIMIT,
+                              timeout=POLLING_TIMEOUT, max_pending=POLLING_MAX_PENDING, tracer=tracer)
+        metrics.UPDATES_QUEUED.set_function(lambda: poller.queued)
+        metrics.UPDATES_IN_FLIGHT.set_function(lambda: poller.in_flight)
+    else:
+        # Очередь обновлений и воркеры живут в том же event loop, что и application
+        dispatcher = UpdateDispatcher(application, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE,
+                                      tracer=tracer)
+        # Telegram повторяет обновление, если вебхук ответил слишком поздно; повтор не обрабатываем
+        deduplicator = UpdateDeduplicator(window=UPDATE_DEDUP_WINDOW, state_path=UPDATE_DEDUP_STATE)
+        web_app.router.add_post("/webhook", webhook)
+        metrics.UPDATES_QUEUED.set_function(lambda: dispatcher.queued)
+        metrics.UPDATES_IN_FLIGHT.set_function(lambda: dispatcher.in_flight)
+
+    # Показатели, которые компоненты считают сами, читаются в момент запроса /metrics
+    metrics.OUTBOX_QUEUED.set_function(lambda: outbox.queued)
+    for pool in (bot_request, get_updates_request):
+        metrics.HTTP_POOL_SIZE.labels(pool.name).set(pool.pool_size)
+        metrics.HTTP_POOL_IN_USE.labels(pool.name).set_function(lambda pool=pool: pool.in_use)
+    metrics.OUTBOX_RETRIES.set_function(lambda: outbox.retries)
+    metrics.MEMORY_USERS.set_function(lambda: len(memory))
+    metrics.MEMORY_BYTES.set_function(lambda: memory.stats()["bytes"])
+    metrics.ANSWER_CACHE_ENTRIES.set_function(lambda: answer_cache.stats()["entries"])
+    metrics.ANSWER_CACHE_BYTES.set_function(lambda: answer_cache.stats()["bytes"])
+    for event in ("hits", "misses", "coalesced", "evictions", "expirations"):
+        metrics.ANSWER_CACHE_EVENTS.labels(event).set_function(lambda event=event: answer_cache.stats()[event])
+    return web_app
+
+
+def attach_gemini(client: GeminiClient) -> None:
+    global gemini, prompt_cache
+
+    gemini = client
+    if GEMINI_API_KEY and GEMINI_KEEPALIVE > 0:
+        try:
+            install_gemini_transport(GEMINI_KEEPALIVE)
+        except Exception as e:
+            logger.warning("Не удалось настроить соединение с Gemini, используется стандартное: %s", e)
+    prompt_cache = PromptCache(
+        gemini,
+        model_name=GEMINI_MODEL,
+        system_instruction=SYSTEM_PROMPT,
+        ttl=GEMINI_CONTEXT_CACHE_TTL,
+        refresh_margin=GEMINI_CONTEXT_CACHE_REFRESH,
+    )
+    metrics.GEMINI_IN_FLIGHT.set_function(lambda: gemini.in_flight)
+    metrics.GEMINI_QUEUED.set_function(lambda: gemini.admission.queued)
+    metrics.HTTP_POOL_SIZE.labels("gemini").set(gemini.admission.concurrency)
+    metrics.HTTP_POOL_IN_USE.labels("gemini").set_function(lambda: gemini.admission.active)
+    for route, breaker in (("primary", gemini.breaker), ("fallback", gemini.fallback_breaker)):
+        metrics.GEMINI_CIRCUIT_OPEN.labels(route).set_function(
+            lambda breaker=breaker: int(breaker.state == breaker.OPEN))
+
+
+routes = web.RouteTableDef()
+
+
+# Маршрут /webhook добавляет create_app(), только в режиме webhook
+async def webhook(request: web.Request) -> web.Response:
+    logger.info("📩 Получено обновление от Telegram")
+    metrics.UPDATES_RECEIVED.inc()
+    try:
+        with metrics.PARSE_SECONDS.time():
+            data = await request.json()
+            if not valid_update_id(data["update_id"]):
+                return web.Response(text="Bad Request", status=400)
+            # Повтор уже принятого обновления подтверждаем, не разбирая его
+            if deduplicator.is_duplicate(data["update_id"]):
+                metrics.UPDATES_DUPLICATE.inc()
+                logger.info("Пропущен повтор обновления %s", data["update_id"])
+                return web.Response(text="OK")
+            update = Update.de_json(data, application.bot)
+    except (ValueError, KeyError, TypeError):
+        return web.Response(text="Bad Request", status=400)
+
+    # Отвечаем Telegram сразу, обработка идёт в воркерах
+    if not dispatcher.submit(update):
+        return web.Response(text="Busy", status=503)
+    deduplicator.record(update.update_id)
+    return web.Response(text="OK")
+
+
+def debug_authorized(request: web.Request) -> bool:
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+
+# Маршруты /debug добавляет create_app(), только если задан DEBUG_TOKEN
+async def debug_profile(request: web.Request) -> web.Response:
+    """Sample all threads for ?seconds=N and return collapsed stacks for a flame graph"""
+    if not debug_authorized(request):
+        return web.Response(text="Unauthorized", status=401)
+    try:
+        seconds = float(request.query.get("seconds", "10"))
+    except ValueError:
+        return web.Response(text="Bad Request", status=400)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return web.Response(text=f"seconds must be above 0 and at most {PROFILE_MAX_SECONDS:g}", status=400)
+    try:
+        stacks = await profiler.profile(seconds)
+    except ProfilerBusyError:
+        return web.Response(text="A profile is already running", status=409)
+    return web.Response(text=stacks)
+
+
+async def debug_traces(request: web.Request) -> web.Response:
+    if not debug_authorized(request):
+        return web.Response(text="Unauthorized", status=401)
+    return web.json_response({
+        "sample_rate": tracer.sample_rate if tracer is not None else 0,
+        "traces": tracer.recent() if tracer is not None else [],
+    })
+
+
+@routes.get("/")
+async def index(request: web.Request) -> web.Response:
+    return web.Response(text=f"Бот работает ({BOT_MODE})")
+
+
+@routes.get("/metrics")
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.REGISTRY.render().encode("utf-8"),
+                        headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+@routes.get("/stats")
+async def stats(request: web.Request) -> web.Response:
+    gemini_stats = None
+    if gemini is not None:
+        gemini_stats = {
+            "active": gemini.admission.active,
+            "queued": gemini.admission.queued,
+            "admitted": gemini.admission.admitted,
+            "shed": gemini.admission.shed,
+            "expected_wait": round(gemini.admission.expected_wait(), 3),
+            "circuit": {"primary": gemini.breaker.state, "fallback": gemini.fallback_breaker.state},
+        }
+    return web.json_response({
+        "answer_cache": answer_cache.stats(),
+        "memory": memory.stats(),
+        "faq": faq.stats(),
+        "updates": deduplicator.stats() if deduplicator is not None else {"offset": poller.offset()},
+        "gemini": gemini_stats,
+    })
+
+
+async def run_web_server(web_app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    # Воркер супервизора принимает обновления только от него
+    host = "0.0.0.0" if WORKER_INDEX is None else "127.0.0.1"
+    site = web.TCPSite(runner, host, PORT)
+    await site.start()
+    return runner
 
 
 async def set_webhook():
     await application.bot.set_webhook(f"{WEBHOOK_URL}/webhook")
 
 
-async def main():
-    await application.initialize()
-    await application.start()
-    await set_webhook()
+async def start_bot() -> web.AppRunner:
+    """Build and start everything; returns the runner of the web server.
+    The webhook accepts updates into the queue as soon as the server is up,
+    the workers start taking them once Telegram and Gemini are ready.
+    Outside supervisor workers the webhook is registered with Telegram here;
+    in polling mode fetching starts only once Gemini is ready."""
+    web_app = create_app()
+    if tracer is not None:
+        tracer.start()
+    # Импорт SDK Gemini идёт в отдельном потоке, пока поднимаются сервер и Telegram
+    gemini_ready = asyncio.ensure_future(asyncio.to_thread(create_gemini))
+    try:
+        runner = await run_web_server(web_app)
+        await application.initialize()
+        await application.start()
+        if WORKER_INDEX is None and BOT_MODE == "webhook":
+            await set_webhook()
+        attach_gemini(await gemini_ready)
+    except BaseException:
+        gemini_ready.cancel()
+        raise
+    if GEMINI_CONTEXT_CACHE and GEMINI_API_KEY:
+        await prompt_cache.start()
+    if poller is not None:
+        await poller.start()
+    else:
+        await dispatcher.start()
+    return runner
 
-    # Запускаем Flask в отдельном потоке
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.start()
 
-    # Чтобы основной цикл не завершался, ждём завершения работы приложения
-    never_set_event = asyncio.Event()
-    await never_set_event.wait()
+async def stop_bot(runner: web.AppRunner) -> None:
+    await runner.cleanup()
+    if poller is not None:
+        await poller.stop()
+    else:
+        await dispatcher.stop()
+    await application.stop()
+    await application.shutdown()
+    if prompt_cache is not None:
+        await prompt_cache.stop()
+    await memory.close()
+    answer_cache.close()
+    if deduplicator is not None:
+        deduplicator.close()
+    if tracer is not None:
+        await tracer.stop()
+
+
+async def main():
+    setup_logging(
+        [__name__, "bot"],
+        level=LOG_LEVEL,
+        log_file=LOG_FILE,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
+        queue_size=LOG_QUEUE_SIZE,
+        max_field_length=LOG_MAX_FIELD_LENGTH,
+    )
+    started = time.perf_counter()
+    runner = await start_bot()
+    cleanup_task = asyncio.create_task(run_rate_limit_cleanup())
+    logger.info("🚀 Бот запущен за %.2f с", time.perf_counter() - started)
+
+    try:
+        # Работаем до SIGINT/SIGTERM (так бота останавливают супервизор и systemd)
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop_event.set)
+        await stop_event.wait()
+    finally:
+        cleanup_task.cancel()
+        await stop_bot(runner)
 
 
 if __name__ == "__main__":